@@ -0,0 +1,92 @@
+"""Latency, throughput and memory of each similarity_scoring inference backend.
+
+Each backend runs in a fresh interpreter so model load time and RSS are not
+polluted by the others. The first run of an ONNX backend also pays for the
+one-off export into ONNX_CACHE_DIR; run twice to see the cached load time.
+With --parity, each optimized backend is also checked against torch with
+similarity_scoring.check_backend_parity.
+
+Usage (from the repository root):
+    python benchmarks/bench_backends.py [--backends torch onnx onnx-int8] [--threads 4] [--repeat 5] [--parity]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+
+def run_worker(backend, threads, repeat, parity):
+    """Measure one backend in this process and print a JSON line."""
+    import psutil
+    import similarity_scoring
+    from similarity_scoring import sentences_dict
+
+    similarity_scoring.EMBEDDING_CACHE_ENABLED = False
+    similarity_scoring.set_backend(backend, num_threads=threads)
+    process = psutil.Process()
+    pairs = list(sentences_dict.values())
+
+    start = time.perf_counter()
+    similarity_scoring.warmup()
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for correct, student in pairs:
+        start = time.perf_counter()
+        similarity_scoring.compute_similarity_and_marks(correct, student)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        similarity_scoring.compute_similarity_and_marks_batch(pairs)
+    throughput = repeat * len(pairs) / (time.perf_counter() - start)
+
+    result = {
+        "backend": backend,
+        "load_s": load_seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))] * 1000,
+        "pairs_per_s": throughput,
+        "rss_mb": process.memory_info().rss / 2 ** 20,
+    }
+    if parity and backend != "torch":
+        result["parity"] = similarity_scoring.check_backend_parity(backend, pairs)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = library default)")
+    parser.add_argument("--repeat", type=int, default=5, help="batched passes over sentences_dict")
+    parser.add_argument("--parity", action="store_true")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.threads, args.repeat, args.parity)
+        return
+
+    print(f"{'backend':<12}{'load s':>9}{'p50 ms':>9}{'p95 ms':>9}{'pairs/s':>10}{'RSS MB':>9}  parity")
+    for backend in args.backends:
+        command = [sys.executable, __file__, "--worker", backend, "--threads", str(args.threads), "--repeat", str(args.repeat)]
+        if args.parity:
+            command.append("--parity")
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        parity = result.get("parity")
+        parity_text = f"max drift {parity['max_drift']:.2f} pp ({'ok' if parity['passed'] else 'FAIL'})" if parity else "-"
+        print(
+            f"{backend:<12}{result['load_s']:>9.2f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+            f"{result['pairs_per_s']:>10.1f}{result['rss_mb']:>9.0f}  {parity_text}"
+        )
+
+
+if __name__ == "__main__":
+    main()
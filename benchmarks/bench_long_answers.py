@@ -0,0 +1,80 @@
+"""Cost and marks of long-answer scoring on synthetic essay-length answers.
+
+Key and student answers are built by chaining the essay-length pairs of
+sentences_dict up to each requested length. Every length is scored three ways:
+  * default mode, where the models truncate anything past their input limit,
+  * long-answer mode (LONG_ANSWER_CANDIDATES student windows per key window),
+  * exhaustive windowing, where every key window meets every student window.
+The report shows time, cross-encoder window pairs and marks of each, so the
+near-linear growth of long-answer mode can be checked against the quadratic
+exhaustive one, and its marks against the exhaustive marks.
+
+Usage (from the repository root):
+    python benchmarks/bench_long_answers.py [--words 100 200 400 800 1600] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import similarity_scoring  # noqa: E402
+from similarity_scoring import sentences_dict  # noqa: E402
+
+LONG_TOPICS = ("artificial_intelligence", "cybersecurity", "data_science", "internet_of_things", "quantum_computing", "machine_learning")
+
+
+def synthetic_pair(words):
+    """(key, student) answers of about `words` key words, chaining the essay-length topics in turn."""
+    key_words, student_words = [], []
+    topic = 0
+    while len(key_words) < words:
+        key, student = sentences_dict[LONG_TOPICS[topic % len(LONG_TOPICS)]]
+        key_words.extend(key.split())
+        student_words.extend(student.split())
+        topic += 1
+    return " ".join(key_words[:words]), " ".join(student_words[:int(words * len(student_words) / len(key_words))])
+
+
+def score(pair, long_answers, candidates, repeat):
+    """Best-of-`repeat` seconds, marks and long-answer counters for one pair."""
+    similarity_scoring.LONG_ANSWER_MODE = long_answers
+    similarity_scoring.LONG_ANSWER_CANDIDATES = candidates
+    best = None
+    for _ in range(repeat):
+        similarity_scoring.reset_long_answer_stats()
+        start = time.perf_counter()
+        result = similarity_scoring.compute_similarity_and_marks_batch([pair])[0]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, float(result["Marks Percentage"]), similarity_scoring.long_answer_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, nargs="+", default=[100, 200, 400, 800, 1600], help="key answer lengths")
+    parser.add_argument("--candidates", type=int, default=similarity_scoring.LONG_ANSWER_CANDIDATES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    similarity_scoring.EMBEDDING_CACHE_ENABLED = False  # Time the models, not the cache
+    similarity_scoring.warmup()
+    print(f"Window: {similarity_scoring._long_answer_window()} tokens, overlap {similarity_scoring.LONG_ANSWER_OVERLAP:.0%}, "
+          f"{args.candidates} candidates per key window\n")
+    print(f"{'words':>6}{'truncated ms':>14}{'%':>7}{'long ms':>10}{'pairs':>7}{'%':>7}{'exhaustive ms':>15}{'pairs':>7}{'%':>7}")
+
+    for words in args.words:
+        pair = synthetic_pair(words)
+        truncated_seconds, truncated_marks, _ = score(pair, False, args.candidates, args.repeat)
+        long_seconds, long_marks, long_stats = score(pair, True, args.candidates, args.repeat)
+        exhaustive_seconds, exhaustive_marks, exhaustive_stats = score(pair, True, sys.maxsize, args.repeat)
+        print(
+            f"{words:>6}{truncated_seconds * 1000:>14.1f}{truncated_marks:>7.1f}"
+            f"{long_seconds * 1000:>10.1f}{long_stats['window_pairs']:>7}{long_marks:>7.1f}"
+            f"{exhaustive_seconds * 1000:>15.1f}{exhaustive_stats['window_pairs']:>7}{exhaustive_marks:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Payload-size benchmark for scanner's client-side image preprocessing.
+
+For every image in the answers folder, reports bytes before/after
+preprocessing and the time spent. With --ocr, each image is also sent to
+Gemini twice (original bytes and preprocessed payload, OCR cache off) to
+check that the extracted text stays the same.
+
+Usage (from the repository root):
+    python benchmarks/bench_preprocessing.py [--folder answers] [--format WEBP] [--quality 80] [--deskew] [--ocr]
+"""
+import argparse
+import difflib
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import scanner  # noqa: E402
+
+
+def ocr_payload(model, payload, mime_type):
+    response = model.generate_content([{"mime_type": mime_type, "data": payload}, scanner.OCR_PROMPT])
+    return response.text if response else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="answers")
+    parser.add_argument("--format", default=scanner.PREPROCESSING["format"], choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=scanner.PREPROCESSING["quality"])
+    parser.add_argument("--max-long-edge", type=int, default=scanner.PREPROCESSING["max_long_edge"])
+    parser.add_argument("--deskew", action="store_true")
+    parser.add_argument("--ocr", action="store_true", help="compare Gemini OCR text before/after (uses API quota)")
+    args = parser.parse_args()
+
+    config = {"format": args.format, "quality": args.quality, "max_long_edge": args.max_long_edge, "deskew": args.deskew}
+    image_files = sorted(f for f in glob.glob(os.path.join(args.folder, "*")) if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    if not image_files:
+        print(f"⚠️ No valid images found in folder '{args.folder}'.")
+        return
+
+    model = scanner.get_model() if args.ocr else None
+    total_before = total_after = total_seconds = 0
+    similarities = []
+
+    print(f"{'image':<28}{'before KB':>11}{'after KB':>10}{'ratio':>8}{'ms':>8}" + ("  text similarity" if args.ocr else ""))
+    for image_file in image_files:
+        with open(image_file, "rb") as f:
+            image_bytes = f.read()
+        payload, mime_type, report = scanner.preprocess_image(image_bytes, config)
+        _, original_mime, _ = scanner.preprocess_image(image_bytes, {"enabled": False})
+
+        total_before += report["bytes_before"]
+        total_after += report["bytes_after"]
+        total_seconds += report["seconds"]
+        line = (
+            f"{os.path.basename(image_file):<28}{report['bytes_before'] / 1024:>11.1f}{report['bytes_after'] / 1024:>10.1f}"
+            f"{report['bytes_after'] / report['bytes_before']:>8.2f}{report['seconds'] * 1000:>8.1f}"
+        )
+        if args.ocr:
+            original_text = ocr_payload(model, image_bytes, original_mime)
+            processed_text = ocr_payload(model, payload, mime_type)
+            similarity = difflib.SequenceMatcher(None, original_text, processed_text).ratio()
+            similarities.append(similarity)
+            line += f"  {similarity:.3f}{' (identical)' if original_text == processed_text else ''}"
+        print(line)
+
+    print(
+        f"\nTotal: {total_before / 1024:.0f} KB → {total_after / 1024:.0f} KB "
+        f"({100 * (1 - total_after / total_before):.1f}% smaller), "
+        f"{1000 * total_seconds / len(image_files):.1f} ms/image"
+    )
+    if similarities:
+        print(f"Mean OCR text similarity: {sum(similarities) / len(similarities):.3f}")
+
+
+if __name__ == "__main__":
+    main()
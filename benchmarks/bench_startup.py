@@ -0,0 +1,67 @@
+"""Startup benchmark for the grading pipeline used by src/app.py.
+
+Measures, in a fresh interpreter:
+  * import time of the pipeline modules,
+  * first-request latency (includes lazy model loading),
+  * steady-state latency once the models are warm.
+
+OCR is not included because it is a network round-trip to Gemini.
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py [--iterations N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+OCR_TEXT = """1) A compiler is a program that translates high-level code into machine code.
+2) An operating system manages the computer hardware and software resources."""
+
+
+def run_pipeline(segregate_ocr_text, preprocess_answers, compute_similarity_and_marks, key_answers):
+    """One grading request: segregate -> preprocess -> score every answered question."""
+    processed_answers = preprocess_answers(segregate_ocr_text(OCR_TEXT))
+    return {
+        q: compute_similarity_and_marks(key_answers[q], ans)
+        for q, ans in processed_answers.items() if q in key_answers
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10, help="steady-state requests to time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from segregator import segregate_ocr_text
+    from tokenizer import preprocess_answers
+    import similarity_scoring
+    import_seconds = time.perf_counter() - start
+
+    key_answers = {
+        "1": similarity_scoring.sentences_dict["compiler"][0],
+        "2": similarity_scoring.sentences_dict["operating_system"][0],
+    }
+    pipeline_args = (segregate_ocr_text, preprocess_answers, similarity_scoring.compute_similarity_and_marks, key_answers)
+
+    start = time.perf_counter()
+    run_pipeline(*pipeline_args)
+    first_request_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        run_pipeline(*pipeline_args)
+        latencies.append(time.perf_counter() - start)
+
+    print(f"Import:          {import_seconds * 1000:10.1f} ms")
+    print(f"First request:   {first_request_seconds * 1000:10.1f} ms")
+    print(f"Steady state:    {statistics.median(latencies) * 1000:10.1f} ms (median of {len(latencies)})")
+
+
+if __name__ == "__main__":
+    main()
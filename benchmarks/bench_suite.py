@@ -0,0 +1,266 @@
+"""Per-stage and end-to-end benchmark of the grading pipeline on synthetic classes.
+
+Gemini is replaced by a fake OCR model that sleeps for --ocr-latency-ms and
+returns a synthetic answer sheet, so runs are free and repeatable; client-side
+image preprocessing still runs on real (generated) images. For each class
+size a fresh interpreter measures:
+  * model load time of the three scoring models and the spaCy pipeline,
+  * per-item latency (p50/p95) and throughput of each stage: process_image,
+    segregate_ocr_text, preprocess_answers, bi-encoder, STS-B cross-encoder
+    and NLI cross-encoder (caches off),
+  * the streaming pipeline (pipeline.grade_sheets) end to end,
+  * peak RSS of the worker and of its process-pool children.
+
+Results are written as JSON (with the git commit) so two runs can be diffed
+with --compare.
+
+Usage (from the repository root):
+    python benchmarks/bench_suite.py [--sizes 10 100 1000] [--output bench_suite.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+QUESTIONS_PER_SHEET = 5
+MODELS = ("bi_encoder", "cross_encoder_stsb", "cross_encoder_nli", "spacy")
+
+
+class FakeOCRModel:
+    """Stands in for the Gemini model: fixed latency, sheet text chosen from the image payload."""
+
+    model_name = "fake-ocr"
+
+    def __init__(self, sheet_texts, latency):
+        self.sheet_texts = sheet_texts
+        self.latency = latency
+
+    def generate_content(self, parts, **kwargs):
+        time.sleep(self.latency)
+        payload = parts[0]["data"] if isinstance(parts[0], dict) else b""
+        return type("Response", (), {"text": self.sheet_texts[zlib.crc32(payload) % len(self.sheet_texts)]})()
+
+
+def synthetic_class(sentences_dict):
+    """Answer key for QUESTIONS_PER_SHEET questions and a pool of differing sheet texts."""
+    topics = list(sentences_dict)
+    answer_key = {str(q): sentences_dict[topics[q - 1]][0] for q in range(1, QUESTIONS_PER_SHEET + 1)}
+    sheet_texts = []
+    for variant in range(len(topics)):
+        lines = [f"{q}) {sentences_dict[topics[(q - 1 + variant) % len(topics)]][1]}" for q in range(1, QUESTIONS_PER_SHEET + 1)]
+        sheet_texts.append("\n".join(lines))
+    return answer_key, sheet_texts
+
+
+def write_images(folder, count, width, height):
+    """Scan-like pages (white background, dark text-line blocks), each one different."""
+    import random
+    from PIL import Image, ImageDraw
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"sheet_{i:04d}.png")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        rng = random.Random(i)
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        for y in range(80, height - 80, 40):
+            x = 60
+            while x < width - 120:
+                word = rng.randint(30, 140)
+                draw.rectangle([x, y, x + word, y + 18], fill=rng.randint(0, 60))
+                x += word + rng.randint(12, 30)
+        image.save(path)
+    return paths
+
+
+def summarize(latencies, wall_seconds=None):
+    """p50/p95 per item in ms and items per second (over wall time when given, else summed latency)."""
+    ordered = sorted(latencies)
+    total = wall_seconds if wall_seconds is not None else sum(ordered)
+    return {
+        "items": len(ordered),
+        "p50_ms": statistics.median(ordered) * 1000 if ordered else 0.0,
+        "p95_ms": ordered[int(0.95 * (len(ordered) - 1))] * 1000 if ordered else 0.0,
+        "throughput_per_s": len(ordered) / total if total else 0.0,
+    }
+
+
+def timed(fn, items):
+    latencies, outputs = [], []
+    for item in items:
+        start = time.perf_counter()
+        outputs.append(fn(item))
+        latencies.append(time.perf_counter() - start)
+    return latencies, outputs
+
+
+def _peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def run_worker(size, image_dir, args):
+    """Benchmark one class size in this process and print a JSON line."""
+    import scanner
+    import similarity_scoring
+    from model_registry import get_model, model_stats
+    from pipeline import grade_sheets
+    from segregator import segregate_ocr_text
+    from tokenizer import preprocess_answers
+
+    scanner.OCR_CACHE_ENABLED = False
+    similarity_scoring.EMBEDDING_CACHE_ENABLED = False
+    answer_key, sheet_texts = synthetic_class(similarity_scoring.sentences_dict)
+    ocr_model = FakeOCRModel(sheet_texts, args.ocr_latency_ms / 1000)
+    image_paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))[:size]
+
+    load_seconds = {}
+    for name in MODELS:
+        start = time.perf_counter()
+        get_model(name)
+        load_seconds[name] = time.perf_counter() - start
+    answer_key = preprocess_answers(answer_key)
+
+    stages = {}
+    latencies, texts = timed(lambda path: scanner.process_image(path, model=ocr_model), image_paths)
+    stages["ocr"] = summarize(latencies)
+    latencies, segregated = timed(segregate_ocr_text, texts)
+    stages["segregate"] = summarize(latencies)
+    latencies, answer_sheets = timed(preprocess_answers, segregated)
+    stages["preprocess"] = summarize(latencies)
+
+    pairs = [[answer_key[q], ans] for sheet in answer_sheets for q, ans in sheet.items() if q in answer_key]
+    bi_encoder, stsb, nli = (get_model(name) for name in MODELS[:3])
+    stages["bi_encoder"] = summarize(timed(lambda pair: bi_encoder.encode(pair, normalize_embeddings=True), pairs)[0])
+    stages["cross_encoder_stsb"] = summarize(timed(stsb.predict, pairs)[0])
+    stages["cross_encoder_nli"] = summarize(timed(lambda pair: nli.predict(pair, apply_softmax=True), pairs)[0])
+
+    # Per-sheet latency here is the time from start until the sheet is yielded
+    completions = []
+    start = time.perf_counter()
+    for _ in grade_sheets(image_paths, answer_key, ocr_concurrency=args.ocr_concurrency, cpu_workers=args.cpu_workers, model=ocr_model):
+        completions.append(time.perf_counter() - start)
+    end_to_end = summarize(completions, wall_seconds=time.perf_counter() - start)
+    end_to_end["wall_s"] = completions[-1] if completions else 0.0
+
+    print(json.dumps({
+        "sheets": size,
+        "pairs": len(pairs),
+        "load_s": load_seconds,
+        "resident_mb": {name: stats["resident_mb"] for name, stats in model_stats()["models"].items() if name in MODELS},
+        "stages": stages,
+        "end_to_end": end_to_end,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    for run in report["runs"]:
+        print(f"\n📊 {run['sheets']} sheets ({run['pairs']} pairs), peak RSS {run['peak_rss_mb']:.0f} MB "
+              f"(+{run['children_peak_rss_mb']:.0f} MB in workers)")
+        print("   load s: " + ", ".join(f"{name} {seconds:.2f}" for name, seconds in run["load_s"].items()))
+        if "resident_mb" in run:
+            print("   resident MB: " + ", ".join(f"{name} {mb:.0f}" for name, mb in run["resident_mb"].items()))
+        print(f"   {'stage':<20}{'p50 ms':>10}{'p95 ms':>10}{'items/s':>11}")
+        for name, stage in [*run["stages"].items(), ("end_to_end", run["end_to_end"])]:
+            print(f"   {name:<20}{stage['p50_ms']:>10.2f}{stage['p95_ms']:>10.2f}{stage['throughput_per_s']:>11.1f}")
+
+
+def print_comparison(report, baseline):
+    """Relative change of every stage metric against a previous report, matched by class size."""
+    previous = {run["sheets"]: run for run in baseline["runs"]}
+    print(f"\n🔁 Compared with {baseline.get('commit') or 'baseline'} (negative latency / positive throughput change is better)")
+    for run in report["runs"]:
+        old = previous.get(run["sheets"])
+        if old is None:
+            continue
+        print(f"   {run['sheets']} sheets:")
+        for name, stage in [*run["stages"].items(), ("end_to_end", run["end_to_end"])]:
+            old_stage = old["stages"].get(name) if name != "end_to_end" else old["end_to_end"]
+            if not old_stage:
+                continue
+            changes = [
+                f"{metric} {100 * (stage[metric] - old_stage[metric]) / old_stage[metric]:+.1f}%"
+                for metric in ("p50_ms", "p95_ms", "throughput_per_s") if old_stage[metric]
+            ]
+            print(f"     {name:<20}" + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="sheets per synthetic class")
+    parser.add_argument("--ocr-latency-ms", type=float, default=50.0, help="simulated Gemini round-trip")
+    parser.add_argument("--ocr-concurrency", type=int, default=4)
+    parser.add_argument("--cpu-workers", type=int, default=0, help="pipeline NLP processes (0 = inline)")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1240, 1754], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--image-dir", help="where synthetic sheets are generated (default: a temp folder)")
+    parser.add_argument("--output", default="bench_suite.json")
+    parser.add_argument("--compare", help="previous --output file to diff against")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.image_dir, args)
+        return
+
+    image_dir = args.image_dir or tempfile.mkdtemp(prefix="bench_sheets_")
+    os.makedirs(image_dir, exist_ok=True)
+    print(f"🖼️ Generating {max(args.sizes)} synthetic sheets in {image_dir}...")
+    write_images(image_dir, max(args.sizes), *args.image_size)
+
+    runs = []
+    for size in args.sizes:
+        print(f"⏱️ Benchmarking {size} sheets...")
+        command = [
+            sys.executable, __file__, "--worker", str(size), "--image-dir", image_dir,
+            "--ocr-latency-ms", str(args.ocr_latency_ms), "--ocr-concurrency", str(args.ocr_concurrency),
+            "--cpu-workers", str(args.cpu_workers),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "ocr_latency_ms": args.ocr_latency_ms, "ocr_concurrency": args.ocr_concurrency,
+            "cpu_workers": args.cpu_workers, "image_size": args.image_size, "questions_per_sheet": QUESTIONS_PER_SHEET,
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Throughput benchmark for tokenizer.preprocess_answer_sheets.
+
+Compares the original per-answer loop (full en_core_web_sm pipeline, one
+nlp(answer) call per answer) against batched nlp.pipe preprocessing with
+the parser and NER excluded, on a synthetic corpus of answer sheets.
+
+Usage (from the repository root):
+    python benchmarks/bench_tokenizer.py [--answers 5000] [--batch-size 256] [--n-process 1 2 4]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import spacy  # noqa: E402
+import tokenizer  # noqa: E402
+from similarity_scoring import sentences_dict  # noqa: E402
+
+QUESTIONS_PER_SHEET = 10
+
+
+def synthetic_sheets(num_answers, seed=0):
+    """Answer sheets of plausible student prose built from the sample key answers."""
+    rng = random.Random(seed)
+    vocabulary = " ".join(correct for correct, _ in sentences_dict.values()).split()
+    fillers = ["the", "is", "a", "of", "and", "which", "it", "to", "in", "because", "."]
+    answers = []
+    for _ in range(num_answers):
+        words = [rng.choice(vocabulary if rng.random() < 0.6 else fillers) for _ in range(rng.randint(15, 120))]
+        answers.append(" ".join(words).capitalize())
+    return [
+        {str(q + 1): answer for q, answer in enumerate(answers[start:start + QUESTIONS_PER_SHEET])}
+        for start in range(0, len(answers), QUESTIONS_PER_SHEET)
+    ]
+
+
+def legacy_preprocess(nlp, sheets):
+    """The original implementation: full pipeline, one nlp() call per answer."""
+    processed_sheets = []
+    for answers_dict in sheets:
+        processed_answers = {}
+        for q_num, answer in answers_dict.items():
+            doc = nlp(answer)
+            processed_answers[q_num] = " ".join(token.lemma_ for token in doc if not token.is_stop and not token.is_punct)
+        processed_sheets.append(processed_answers)
+    return processed_sheets
+
+
+def timed(label, num_answers, fn):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    print(f"{label:<36}{seconds:>9.2f} s{num_answers / seconds:>12.0f} answers/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=tokenizer.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--n-process", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    sheets = synthetic_sheets(args.answers)
+    print(f"{args.answers} answers on {len(sheets)} sheets\n")
+
+    start = time.perf_counter()
+    full_nlp = spacy.load(tokenizer.SPACY_MODEL_NAME)
+    print(f"{'load full pipeline':<36}{time.perf_counter() - start:>9.2f} s")
+    start = time.perf_counter()
+    tokenizer.get_model("spacy")
+    print(f"{'load trimmed pipeline':<36}{time.perf_counter() - start:>9.2f} s\n")
+
+    expected = timed("per-answer loop (full pipeline)", args.answers, lambda: legacy_preprocess(full_nlp, sheets))
+    for n_process in args.n_process:
+        result = timed(
+            f"nlp.pipe batch={args.batch_size} n_process={n_process}", args.answers,
+            lambda: tokenizer.preprocess_answer_sheets(sheets, batch_size=args.batch_size, n_process=n_process),
+        )
+        if result != expected:
+            print("  ⚠️ output differs from the per-answer loop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Mark drift of the cascade scoring mode against the full three-model result.
+
+Scores every pair in sentences_dict with the full bi-encoder + STS-B + NLI
+model set and again in cascade mode, then reports per-topic marks, the
+absolute drift, which stage settled each pair, and the time taken.
+
+Usage (from the repository root):
+    python benchmarks/eval_cascade.py [--low 0.45] [--high 0.97]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import similarity_scoring  # noqa: E402
+from similarity_scoring import sentences_dict  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--low", type=float, default=similarity_scoring.CASCADE_LOW_BAND)
+    parser.add_argument("--high", type=float, default=similarity_scoring.CASCADE_HIGH_BAND)
+    args = parser.parse_args()
+
+    # Time the models, not the cache: the cascade run would otherwise reuse the full run's embeddings
+    similarity_scoring.EMBEDDING_CACHE_ENABLED = False
+    similarity_scoring.warmup()
+    pairs = list(sentences_dict.values())
+
+    start = time.perf_counter()
+    full = similarity_scoring.compute_similarity_and_marks_batch(pairs)
+    full_seconds = time.perf_counter() - start
+
+    similarity_scoring.reset_cascade_stats()
+    start = time.perf_counter()
+    cascade = similarity_scoring.compute_similarity_and_marks_cascade(pairs, low_band=args.low, high_band=args.high)
+    cascade_seconds = time.perf_counter() - start
+
+    print(f"{'topic':<26}{'bi-enc':>8}{'full %':>9}{'cascade %':>11}{'drift':>8}  stage")
+    drifts = []
+    for topic, full_result, cascade_result in zip(sentences_dict, full, cascade):
+        drift = abs(float(full_result["Marks Percentage"]) - float(cascade_result["Marks Percentage"]))
+        drifts.append(drift)
+        print(
+            f"{topic:<26}{float(full_result['Bi-Encoder Score']):>8.3f}{float(full_result['Marks Percentage']):>9.2f}"
+            f"{float(cascade_result['Marks Percentage']):>11.2f}{drift:>8.2f}  {cascade_result['Cascade Stage']}"
+        )
+
+    stats = similarity_scoring.cascade_stats()
+    print(f"\nBands: low <= {args.low}, high >= {args.high}")
+    print(f"Settled by bi-encoder: {stats['bi_encoder']}/{stats['pairs']} ({100 * stats['bi_encoder_rate']:.0f}%)")
+    print(f"Sent to cross-encoders: {stats['cross_encoders']}/{stats['pairs']} ({100 * stats['cross_encoders_rate']:.0f}%)")
+    print(f"Mark drift: mean {sum(drifts) / len(drifts):.2f}, max {max(drifts):.2f} percentage points")
+    print(f"Time: full {full_seconds * 1000:.0f} ms, cascade {cascade_seconds * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Exact and near-duplicate student answers, indexed per exam question.
+
+Answers that are identical after normalization (see embedding_cache.normalize_text)
+reuse the scores of the first copy instead of going through the models again.
+Answers whose bi-encoder embedding is within NEAR_DUPLICATE_THRESHOLD cosine
+similarity of an earlier answer to the same question are flagged, e.g. for a
+copying check, but are still scored normally. Near neighbours are found with
+random-hyperplane LSH, so a lookup only compares against answers that share a
+bucket instead of against the whole class. Blank and very short answers
+(fewer than MIN_DUPLICATE_WORDS words) still reuse scores but are never
+flagged: students who left a question empty have not copied each other.
+
+    index = AnswerIndex()
+    for sheet in grade_sheets(images, answer_key, answer_index=index):
+        sheet["duplicates"]   # {question: [(image path, similarity), ...]}
+    index.stats()             # pairs, scored, reused, model_calls_avoided, near_duplicates
+"""
+import os
+from collections import defaultdict
+import numpy as np
+from embedding_cache import text_hash
+from instrumentation import CACHE_LOOKUPS, counter, get_logger
+
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.95"))  # 0 disables near-duplicate flags
+MIN_DUPLICATE_WORDS = 3  # Shorter answers agree by chance too often to count as copies
+LSH_TABLES = 8  # More tables find more true neighbours, at the cost of more candidates per lookup
+LSH_BITS = 10
+MODEL_CALLS_PER_PAIR = 3  # Bi-encoder, STS-B and NLI
+
+MODEL_CALLS_AVOIDED = counter("grading_model_calls_avoided_total", "Model invocations skipped by reusing duplicate answers' scores")
+
+log = get_logger("answer_index")
+
+
+class _LshIndex:
+    """Random-hyperplane LSH over unit vectors; rows sharing a bucket in any table are candidates."""
+
+    def __init__(self, dim, tables=LSH_TABLES, bits=LSH_BITS, seed=0):
+        self._planes = np.random.default_rng(seed).standard_normal((tables, bits, dim)).astype(np.float32)
+        self._powers = 1 << np.arange(bits)
+        self._buckets = [defaultdict(list) for _ in range(tables)]
+        self._vectors = []
+
+    def _keys(self, vector):
+        return ((self._planes @ vector) > 0) @ self._powers
+
+    def add(self, vector):
+        row = len(self._vectors)
+        self._vectors.append(vector)
+        for buckets, key in zip(self._buckets, self._keys(vector)):
+            buckets[key].append(row)
+        return row
+
+    def query(self, vector, threshold):
+        """[(row, similarity)] of stored vectors at or above `threshold`, most similar first."""
+        rows = sorted({row for buckets, key in zip(self._buckets, self._keys(vector)) for row in buckets.get(key, ())})
+        if not rows:
+            return []
+        similarities = np.stack([self._vectors[row] for row in rows]) @ vector
+        return [(rows[k], float(similarities[k])) for k in np.argsort(-similarities, kind="stable") if similarities[k] >= threshold]
+
+
+class _QuestionIndex:
+    """Scored answers of one question (for one key answer and scoring mode)."""
+
+    def __init__(self):
+        self.results = {}  # answer hash -> (label, result)
+        self.labels = []  # LSH row -> label
+        self.lsh = None
+
+
+class AnswerIndex:
+    """Duplicate index for one exam, kept across scoring batches.
+
+    Questions are told apart by question id, key answer and scoring mode, so an
+    edited key or a switch to cascade mode never reuses stale scores.
+    `encode_fn` maps a list of texts to unit-length embeddings (default:
+    similarity_scoring.encode_texts); a `threshold` of 0 skips the embeddings
+    and only exact duplicates are detected. Not thread-safe; the pipeline
+    scores from a single thread.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, encode_fn=None):
+        self.threshold = threshold
+        self.encode_fn = encode_fn
+        self._questions = defaultdict(_QuestionIndex)
+        self._totals = {"pairs": 0, "scored": 0, "reused": 0, "model_calls_avoided": 0, "near_duplicates": 0}
+
+    def _encode(self, texts):
+        if self.encode_fn is not None:
+            return self.encode_fn(texts)
+        import similarity_scoring
+        return similarity_scoring.encode_texts(texts, cache=similarity_scoring.CACHE_STUDENT_EMBEDDINGS)
+
+    def _flag_near_duplicates(self, question_index, answers, labels):
+        """Near-duplicate matches of each new answer against earlier ones (and each other), then index them."""
+        vectors = np.asarray(self._encode(answers), dtype=np.float32)
+        if question_index.lsh is None:
+            question_index.lsh = _LshIndex(vectors.shape[1])
+        flags = []
+        for vector, label in zip(vectors, labels):
+            matches = question_index.lsh.query(vector, self.threshold)
+            flags.append([(question_index.labels[row], similarity) for row, similarity in matches])
+            question_index.lsh.add(vector)
+            question_index.labels.append(label)
+        return flags
+
+    def score(self, items, score_fn, cascade=False):
+        """Score [(question, key_answer, answer, label)], sending only unseen answers to `score_fn`.
+
+        `score_fn(pairs, cascade=...)` is e.g. compute_similarity_and_marks_batch;
+        labels (such as image paths) identify answers in duplicate flags.
+        Returns (results, duplicates, report): one scoring dict and one list of
+        (label, similarity) matches per item, and the batch's reuse counts.
+        """
+        groups, hashes, flaggable = [], [], []
+        new = {}  # (group key, answer hash) -> item position
+        for i, (question, key_answer, answer, _) in enumerate(items):
+            group = (str(question), text_hash(key_answer), cascade)
+            answer_hash = text_hash(answer)
+            groups.append(group)
+            hashes.append(answer_hash)
+            flaggable.append(len(answer.split()) >= MIN_DUPLICATE_WORDS)
+            if answer_hash not in self._questions[group].results:
+                new.setdefault((group, answer_hash), i)
+        CACHE_LOOKUPS.inc(len(items) - len(new), cache="answers", result="hit")
+        CACHE_LOOKUPS.inc(len(new), cache="answers", result="miss")
+
+        # Only the first copy of each answer goes through the models
+        positions = list(new.values())
+        scored = score_fn([(items[i][1], items[i][2]) for i in positions], cascade=cascade) if positions else []
+        near_duplicates = {}
+        if self.threshold and positions:
+            by_group = defaultdict(list)
+            for i in positions:
+                if flaggable[i]:
+                    by_group[groups[i]].append(i)
+            for group, group_positions in by_group.items():
+                flags = self._flag_near_duplicates(self._questions[group], [items[i][2] for i in group_positions],
+                                                   [items[i][3] for i in group_positions])
+                near_duplicates.update(zip(group_positions, flags))
+        for i, result in zip(positions, scored):
+            self._questions[groups[i]].results[hashes[i]] = (items[i][3], result)
+
+        results, duplicates, scored_positions = [], [], set(positions)
+        report = {"pairs": len(items), "scored": len(positions), "reused": len(items) - len(positions), "model_calls_avoided": 0}
+        for i in range(len(items)):
+            label, result = self._questions[groups[i]].results[hashes[i]]
+            results.append(dict(result))
+            if i in scored_positions:
+                duplicates.append(near_duplicates.get(i, []))
+            else:
+                duplicates.append([(label, 1.0)] if flaggable[i] else [])
+                # A pair the cascade settled with the bi-encoder alone only cost one model call
+                report["model_calls_avoided"] += 1 if result.get("Cascade Stage") == "bi_encoder" else MODEL_CALLS_PER_PAIR
+        report["near_duplicates"] = sum(1 for flags in near_duplicates.values() if flags)
+
+        for key, value in report.items():
+            self._totals[key] += value
+        MODEL_CALLS_AVOIDED.inc(report["model_calls_avoided"])
+        if report["reused"] or report["near_duplicates"]:
+            log.info(f"♻️ Reused scores for {report['reused']}/{report['pairs']} answers "
+                     f"({report['model_calls_avoided']} model calls avoided), {report['near_duplicates']} near-duplicates",
+                     extra={"fields": report})
+        return results, duplicates, report
+
+    def stats(self):
+        """Totals over every batch scored through this index."""
+        stats = dict(self._totals)
+        stats["reuse_rate"] = stats["reused"] / (stats["pairs"] or 1)
+        return stats
@@ -1,25 +1,40 @@
 import streamlit as st
 import os
-import tempfile
 import time
 import pandas as pd
-import google.generativeai as genai
 from dotenv import load_dotenv
 import numpy as np
-from scanner import process_image
-from segregator import segregate_ocr_text
-from tokenizer import preprocess_answers
-from similarity_scoring import sentences_dict, compute_similarity_and_marks
+from instrumentation import configure_logging, get_logger
+from scanner import get_model as get_ocr_model, ocr_cache_stats
+from pipeline import grade_sheets
+from gemini_evaluator import evaluate_similarity, iter_batched_evaluations
+from results_store import append_rows, content_hash, latest_run_id, new_run_id, read_results, score_rows
+from similarity_scoring import sentences_dict
+# Scoring and lemmatization go to the shared inference server when INFERENCE_SERVER_URL is set
+from inference_client import compute_similarity_and_marks, compute_similarity_and_marks_batch, analyse_text
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Get API key and model name from environment variables
+# Pipeline progress goes to the server console (plain or JSON lines, see instrumentation)
+configure_logging()
+log = get_logger("app")
+
+# Get API key from environment variables (the Gemini client itself lives in gemini_evaluator)
 API_KEY = os.getenv("API_KEY")
-MODEL_NAME = os.getenv("MODEL_NAME", "gemini-pro-vision")
 
-# Configure Gemini API
-genai.configure(api_key=API_KEY)
+# How "Evaluate All Topics" runs are recorded in the results store
+DEMO_EXAM_ID = "similarity_demo"
+DEMO_STUDENT_ID = "sample"
+DEMO_SHEET = "sentences_dict"
+CHART_METHODS = {"marks": "Model", "gemini": "Gemini", "final": "Average"}
+
+
+@st.cache_resource
+def load_ocr_model():
+    """Gemini OCR client, created once per server process and shared by every session."""
+    return get_ocr_model()
+
 
 # Set up Streamlit page
 tab1, tab2 = st.tabs(["Smart Exam Grading", "Similarity Scoring"])
@@ -28,46 +43,72 @@ with tab1:
     st.title("📄 Smart Exam Grading")
 
     # File uploader
-    uploaded_files = st.file_uploader("Upload Answer Sheets", type=["png", "jpg", "jpeg", "webp"], accept_multiple_files=True)
+    uploaded_files = st.file_uploader("Upload Answer Sheets", type=["png", "jpg", "jpeg", "webp", "pdf", "tif", "tiff"],
+                                      accept_multiple_files=True)
+    show_timings = st.checkbox("Show per-sheet timing breakdown", key="show_timings")
 
     def process_uploaded_images(files):
         if not files:
             st.warning("⚠️ Please upload at least one image.")
             return
 
-        results = {}  # Store processed results
-
-        for i, file in enumerate(files, start=1):
-            with st.spinner(f"📸 Processing Image {i}/{len(files)}: {file.name}..."):
-                # Save uploaded file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as temp_file:
-                    temp_file.write(file.read())
-                    temp_file_path = temp_file.name
-
-                # Step 1: Extract text from image
-                extracted_text = process_image(temp_file_path)
-                print(extracted_text)
-
-                processed_answers = {}
-                if extracted_text:
-                    # Step 2: Segregate into Q&A format
-                    qa_dict = segregate_ocr_text(extracted_text)
-
-                    # Step 3: Tokenize & Lemmatize answers
-                    processed_answers = preprocess_answers(qa_dict)
-
-                    # Store results
-                    results[file.name] = processed_answers
+        # Sheets already graded in this session (keyed by upload content) are not sent again
+        graded = st.session_state.setdefault("graded_uploads", {})
+        upload_hashes = [content_hash(file.getvalue()) for file in files]
+        new_uploads = {h: file for h, file in zip(upload_hashes, files) if h not in graded}
+
+        if new_uploads:
+            # Uploads go to OCR straight from memory; nothing is written to disk.
+            # OCR and NLP overlap across sheets; NLP runs on a thread here because
+            # Streamlit's script runner is not a safe process-pool parent.
+            new_hashes = list(new_uploads)
+            graded_sheets = grade_sheets(
+                [new_uploads[h].getvalue() for h in new_hashes], cpu_workers=0, model=load_ocr_model(),
+                analyse_fn=analyse_text, score_fn=compute_similarity_and_marks_batch,
+            )
+            for i in range(1, len(new_hashes) + 1):
+                with st.spinner(f"📸 Processing Image {i}/{len(new_hashes)}..."):
+                    sheet = next(graded_sheets)
+                upload_hash = new_hashes[sheet["index"]]
+                log.debug(sheet["text"], extra={"fields": {"sheet": new_uploads[upload_hash].name}})
+                if sheet["text"] is None:
+                    # Not memoized, so the next click sends it to OCR again
+                    st.error(f"❌ No text could be read from {new_uploads[upload_hash].name}; try again.")
+                    continue
+                graded[upload_hash] = {"text": sheet["text"], "answers": sheet["answers"], "timings": sheet["timings"]}
+
+        st.session_state["shown_uploads"] = upload_hashes
+
+    def show_graded_uploads(files):
+        """Render the session's graded sheets for the current uploads (survives reruns)."""
+        graded = st.session_state.get("graded_uploads", {})
+        names = {content_hash(file.getvalue()): file.name for file in files or []}
+        shown = [h for h in st.session_state.get("shown_uploads", []) if h in names and h in graded]
+        if not shown:
+            return
 
-            # Show final answers only after processing
-            st.success(f"✅ Processed: {file.name}")
+        timings = []
+        for upload_hash in shown:
+            sheet = graded[upload_hash]
+            st.success(f"✅ Processed: {names[upload_hash]}")
             st.write("### 📝 Final Processed Answers")
-            for q, ans in processed_answers.items():
+            for q, ans in sheet["answers"].items():
                 st.write(f"**Q{q}:** {ans}")
+            timings.append({"Sheet": names[upload_hash], **{stage: seconds or 0.0 for stage, seconds in sheet["timings"].items()}})
+
+        cache_stats = ocr_cache_stats()
+        st.caption(f"♻️ OCR cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+
+        if show_timings:
+            st.write("### ⏱️ Timing Breakdown (seconds)")
+            timing_df = pd.DataFrame(timings).rename(columns={"ocr": "OCR", "nlp": "NLP", "scoring": "Scoring"}).set_index("Sheet")
+            st.dataframe(timing_df.style.format("{:.2f}"))
+            st.bar_chart(timing_df)
 
     # Button to process uploaded images
     if st.button("📥 Submit & Process", key="grading_submit"):
         process_uploaded_images(uploaded_files)
+    show_graded_uploads(uploaded_files)
 
 with tab2:
     st.title("Hybrid Sentence Similarity Scoring")
@@ -75,105 +116,23 @@ with tab2:
 
     # Create a function to evaluate similarity with Gemini
     def evaluate_similarity_with_gemini(correct_answer, student_answer):
-        try:
-            # Set up the model
-            model = genai.GenerativeModel(MODEL_NAME)
-            
-            # Create the prompt
-            prompt = f"""
-            I need you to evaluate the similarity between these two sentences:
-
-CORRECT ANSWER: "{correct_answer}"
-
-STUDENT ANSWER: "{student_answer}"
-
-Please provide:
-
-A semantic similarity score as a percentage from 0 to 100.
-
-The score should reflect how much of the correct answer's meaning is captured in the student's answer.
-
-The score must increase gradually as the student includes more concepts or ideas from the correct answer — this is partial scoring, not all-or-nothing.
-
-Do not give high marks just because keywords are similar. Only increase marks when the student expresses the correct ideas, even in different words.
-
-If the student partially explains the correct answer, give a medium score (e.g., 30–70%) depending on how much is covered.
-
-If the meaning is mostly accurate, give a high score (e.g., 80–100%).
-
-If the meaning is completely wrong or missing, then give a low score (e.g., 0–20%).
-
-A brief explanation focusing on what parts were correct and what concepts were missing. Explain why the score was given, as if you're providing helpful, constructive feedback to a student.
-
-A list of the key missing concepts from the correct answer that the student did not include or misunderstood.
-            """
-            
-            # Generate response
-            response = model.generate_content(prompt)
-            
-            # Parse the response
-            response_text = response.text
-            
-            # Log the full response for debugging (only during development)
-            # st.write("### Full Gemini Response")
-            # st.code(response_text)
-
-            # Extract score
-            if "SCORE:" in response_text:
-                score_text = response_text.split("SCORE:")[1].split("\n")[0].strip()
-            elif "**Semantic Similarity Score:**" in response_text:
-                score_text = response_text.split("**Semantic Similarity Score:**")[1].split("%")[0].strip()
-            elif "Semantic Similarity Score:" in response_text:
-                score_text = response_text.split("Semantic Similarity Score:")[1].split("%")[0].strip()
-            else:
-                score_text = "0"
-                
-            try:
-                score = float(score_text)
-            except ValueError as e:
-                st.error(f"Error parsing score: {str(e)}")
-                score = 0
-                
-            # Extract explanation
-            if "EXPLANATION:" in response_text:
-                explanation = response_text.split("EXPLANATION:")[1].split("MISSING CONCEPTS:")[0].strip()
-            elif "**Explanation:**" in response_text:
-                explanation = response_text.split("**Explanation:**")[1].split("**Missing Concepts:**")[0].strip() if "**Missing Concepts:**" in response_text else response_text.split("**Explanation:**")[1].strip()
-            else:
-                explanation = "No explanation provided."
-            
-            # Extract missing concepts
-            if "MISSING CONCEPTS:" in response_text:
-                missing_concepts = response_text.split("MISSING CONCEPTS:")[1].strip()
-            elif "**Missing Concepts:**" in response_text:
-                missing_concepts = response_text.split("**Missing Concepts:**")[1].strip()
-            else:
-                missing_concepts = "None identified."
-            
-            return {
-                "Score": score,
-                "Explanation": explanation,
-                "Missing Concepts": missing_concepts,
-                "Full Response": response_text
-            }
-        except Exception as e:
-            st.error(f"Error in Gemini evaluation: {str(e)}")
-            return {
-                "Score": 0,
-                "Explanation": f"Error: {str(e)}",
-                "Missing Concepts": "Evaluation failed",
-                "Full Response": "Error occurred"
-            }
+        # One shared client, structured JSON reply, retries on rate limits and malformed replies
+        gemini_results = evaluate_similarity(correct_answer, student_answer)
+        if "Error" in gemini_results:
+            st.error(f"Error in Gemini evaluation: {gemini_results['Error']}")
+        return gemini_results
 
     # Function that combines both scoring methods
-    def hybrid_similarity_scoring(correct_answer, student_answer):
-        # Get model-based scoring
-        model_results = compute_similarity_and_marks(correct_answer, student_answer)
+    def hybrid_similarity_scoring(correct_answer, student_answer, model_results=None, gemini_results=None):
+        # Get model-based scoring (callers scoring many pairs pass batched results in)
+        if model_results is None:
+            model_results = compute_similarity_and_marks(correct_answer, student_answer)
         model_score = model_results["Marks Percentage"]
         
-        # Get Gemini-based scoring
-        with st.spinner("Getting Gemini evaluation..."):
-            gemini_results = evaluate_similarity_with_gemini(correct_answer, student_answer)
+        # Get Gemini-based scoring (callers scoring many pairs pass concurrent results in)
+        if gemini_results is None:
+            with st.spinner("Getting Gemini evaluation..."):
+                gemini_results = evaluate_similarity_with_gemini(correct_answer, student_answer)
         gemini_score = gemini_results["Score"]
         
         # Calculate average score
@@ -250,59 +209,67 @@ A list of the key missing concepts from the correct answer that the student did
         else:
             all_results = {}
             progress = st.progress(0)
-            
+
+            # Model-based scores for every topic in one batched pass per model
+            with st.spinner("Running model-based scoring for all topics..."):
+                batch_model_results = compute_similarity_and_marks_batch(sentences_dict[topic] for topic in topic_options)
+
+            # Gemini evaluations are packed several topics per request and sent concurrently
+            gemini_results = {}
+            with st.spinner(f"Getting Gemini evaluations for {len(topic_options)} topics..."):
+                for done, (i, result) in enumerate(iter_batched_evaluations(sentences_dict[topic] for topic in topic_options), start=1):
+                    gemini_results[i] = result
+                    progress.progress(done / len(topic_options))
+
             for i, topic in enumerate(topic_options):
                 correct_answer, student_answer = sentences_dict[topic]
-                with st.spinner(f"Evaluating {topic} ({i+1}/{len(topic_options)})..."):
-                    all_results[topic] = hybrid_similarity_scoring(correct_answer, student_answer)
-                    progress.progress((i+1)/len(topic_options))
-            
-            # Display all results in a table
-            results_data = []
-            for topic, result in all_results.items():
-                results_data.append({
-                    "Topic": topic.capitalize(),
-                    "Model Score": f"{result['Model Score']:.1f}%",
-                    "Gemini Score": f"{result['Gemini Score']:.1f}%",
-                    "Final Score": f"{result['Average Score']:.1f}%",
-                    "Analysis": result["Gemini Details"]["Explanation"]
-                })
-            
-            results_df = pd.DataFrame(results_data)
-            st.subheader("All Evaluation Results")
-            st.dataframe(results_df)
-            
-            # Visualization of scores
-            st.subheader("Score Comparison")
-            
-            # Prepare data for visualization
-            chart_data = pd.DataFrame({
-                "Topic": [],
-                "Score": [],
-                "Method": []
-            })
+                if "Error" in gemini_results[i]:
+                    st.error(f"Error in Gemini evaluation of {topic}: {gemini_results[i]['Error']}")
+                all_results[topic] = hybrid_similarity_scoring(correct_answer, student_answer, batch_model_results[i], gemini_results[i])
             
+            # Persist every stage score of this run, then build the views from the store
+            run_id = new_run_id()
+            rows = []
             for topic, result in all_results.items():
-                # Add model score
-                chart_data = pd.concat([chart_data, pd.DataFrame({
-                    "Topic": [topic.capitalize()],
-                    "Score": [result["Model Score"]],
-                    "Method": ["Model"]
-                })])
-                
-                # Add Gemini score
-                chart_data = pd.concat([chart_data, pd.DataFrame({
-                    "Topic": [topic.capitalize()],
-                    "Score": [result["Gemini Score"]],
-                    "Method": ["Gemini"]
-                })])
-                
-                # Add Average score
-                chart_data = pd.concat([chart_data, pd.DataFrame({
-                    "Topic": [topic.capitalize()],
-                    "Score": [result["Average Score"]],
-                    "Method": ["Average"]
-                })])
-            
-            # Create grouped bar chart
-            st.bar_chart(chart_data, x="Topic", y="Score", color="Method")
+                rows += score_rows(DEMO_EXAM_ID, run_id, DEMO_STUDENT_ID, DEMO_SHEET, topic, result["Model Details"])
+                rows.append({"exam_id": DEMO_EXAM_ID, "run_id": run_id, "student_id": DEMO_STUDENT_ID, "sheet": DEMO_SHEET,
+                             "question": topic, "stage": "gemini", "score": float(result["Gemini Score"]),
+                             "detail": result["Gemini Details"]["Explanation"]})
+                rows.append({"exam_id": DEMO_EXAM_ID, "run_id": run_id, "student_id": DEMO_STUDENT_ID, "sheet": DEMO_SHEET,
+                             "question": topic, "stage": "final", "score": float(result["Average Score"]), "detail": None})
+            append_rows(rows)
+            st.session_state["evaluation_run_id"] = run_id
+
+    # Results of the latest "Evaluate All Topics" run survive reruns because they come from the results store
+    evaluation_run_id = st.session_state.get("evaluation_run_id") or latest_run_id(DEMO_EXAM_ID)
+    if evaluation_run_id:
+        stored = read_results(exam_id=DEMO_EXAM_ID, run_id=evaluation_run_id, stage=list(CHART_METHODS),
+                              columns=["question", "stage", "score", "detail"])
+        stored["Topic"] = stored["question"].str.capitalize()
+
+        # Display all results in a table
+        # pivot_table sorts its index; keep the sentences_dict order the rest of the tab uses
+        topic_order = [topic.capitalize() for topic in topic_options]
+        scores = stored.pivot_table(index="Topic", columns="stage", values="score", aggfunc="last").reindex(topic_order)
+        analysis = stored[stored["stage"] == "gemini"].set_index("Topic")["detail"].reindex(topic_order)
+        results_df = pd.DataFrame({
+            "Model Score": scores["marks"].map("{:.1f}%".format),
+            "Gemini Score": scores["gemini"].map("{:.1f}%".format),
+            "Final Score": scores["final"].map("{:.1f}%".format),
+            "Analysis": analysis,
+        }).reset_index()
+        st.subheader("All Evaluation Results")
+        st.dataframe(results_df)
+
+        # Visualization of scores
+        st.subheader("Score Comparison")
+
+        # Long-format store rows are already chart-shaped
+        chart_data = pd.DataFrame({
+            "Topic": stored["Topic"],
+            "Score": stored["score"],
+            "Method": stored["stage"].map(CHART_METHODS),
+        })
+
+        # Create grouped bar chart
+        st.bar_chart(chart_data, x="Topic", y="Score", color="Method")
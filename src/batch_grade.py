@@ -0,0 +1,270 @@
+"""Headless, resumable batch grading across a process pool.
+
+Sheets are split into small chunks that worker processes grade with the
+streaming pipeline (each worker loads the models once and keeps them).
+Completed chunks are written to the results store and only then checkpointed
+in a journal, so an interrupted run picks up where it stopped: rerun the same
+command and sheets already in the journal (with an unchanged image) are
+skipped. Sheets whose OCR failed are not journaled and are retried on resume.
+A sheet stored but not yet journaled when the run stopped is graded again
+under the same run id; the results store reads back only its newest rows.
+
+Usage (from the repository root):
+    python src/batch_grade.py --input answers --answer-key answer_key.json --exam-id midterm
+    python src/batch_grade.py --manifest sheets.csv --exam-id midterm [--workers 4] [--restart]
+
+A manifest has one sheet per line, either "path" or "student_id,path".
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import similarity_scoring
+from instrumentation import configure_logging, get_logger, write_metrics
+from results_store import ResultsWriter, content_hash, file_hash, new_run_id
+from model_registry import MODEL_MEMORY_BUDGET_MB
+from regrade import item_provenance, use_stored_scoring_params
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(".cache", "journals"))
+DEFAULT_CHUNK_SIZE = 8  # Sheets per worker task; small chunks keep the pool balanced and checkpoints frequent
+# Three RoBERTa-sized scoring models + spaCy, fp32, plus working memory; a model memory budget caps it
+MEMORY_PER_WORKER_GB = MODEL_MEMORY_BUDGET_MB / 1024 if MODEL_MEMORY_BUDGET_MB else 2.0
+TOTAL_OCR_CONCURRENCY = 8  # Gemini requests in flight across all workers
+
+log = get_logger("batch_grade")
+
+
+def read_manifest(path):
+    """[(student_id, image_path)] from a manifest file; relative paths are taken from the manifest's folder."""
+    base = os.path.dirname(os.path.abspath(path))
+    sheets = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            student_id, _, image_path = line.rpartition(",")
+            image_path = os.path.join(base, image_path.strip())
+            sheets.append((student_id.strip() or os.path.splitext(os.path.basename(image_path))[0], image_path))
+    return sheets
+
+
+def default_workers(memory_per_worker_gb=MEMORY_PER_WORKER_GB):
+    """As many workers as there are cores, but no more than the available memory can hold model copies for."""
+    import psutil
+
+    cores = os.cpu_count() or 1
+    by_memory = int(psutil.virtual_memory().available / (memory_per_worker_gb * 2 ** 30))
+    return max(1, min(cores, by_memory))
+
+
+class Journal:
+    """Append-only JSON-lines checkpoint of the sheets a run has finished.
+
+    The first line identifies the run (exam, run id, answer-key hash); every
+    further line is one finished sheet. Each checkpoint is fsynced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.done = {}  # image path -> image hash
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn last line from a crash mid-write
+                if self.header is None:
+                    self.header = entry
+                else:
+                    self.done[entry["image"]] = entry["image_hash"]
+        return self.header is not None
+
+    def start(self, header):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.header, self.done = header, {}
+        self._append([header], mode="w")
+
+    def checkpoint(self, sheets):
+        """Record finished sheets ({"image", "image_hash", ...}) durably."""
+        self._append(sheets)
+        self.done.update((sheet["image"], sheet["image_hash"]) for sheet in sheets)
+
+    def _append(self, entries, mode="a"):
+        with open(self.path, mode, encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _init_worker(num_threads, scoring_params):
+    """Process-pool initializer: the parent's scoring parameters, and torch/ONNX threads capped to a share of the cores."""
+    import similarity_scoring
+
+    configure_logging()
+    similarity_scoring.set_scoring_params(scoring_params)
+    if num_threads:
+        similarity_scoring.set_backend(similarity_scoring.SCORING_BACKEND, num_threads=num_threads)
+
+
+_answer_index = None  # Per process, so duplicates are only found among the sheets one worker grades
+
+
+def grade_chunk(image_paths, answer_key, ocr_concurrency, cascade=False):
+    """Grade a few sheets in this process; returns one summary dict per sheet."""
+    global _answer_index
+    from answer_index import AnswerIndex
+    from pipeline import grade_sheets
+
+    if _answer_index is None:
+        _answer_index = AnswerIndex()
+    graded = []
+    for sheet in grade_sheets(image_paths, answer_key, ocr_concurrency=ocr_concurrency, cpu_workers=0, cascade=cascade,
+                              answer_index=_answer_index):
+        graded.append({
+            "image": sheet["image"],
+            "image_hash": file_hash(sheet["image"]),
+            "text_hash": content_hash(sheet["text"]) if sheet["text"] else None,
+            "answers": sheet["answers"],
+            "marks": {q: {key: (None if value is None else float(value)) for key, value in result.items() if key != "Cascade Stage"}
+                      for q, result in (sheet["marks"] or {}).items()},
+            "timings": sheet["timings"],
+            "duplicates": {q: [(os.path.basename(path), similarity) for path, similarity in matches]
+                           for q, matches in sheet["duplicates"].items()},
+        })
+    return graded
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def batch_grade(sheets, answer_key, exam_id, journal_path=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                ocr_concurrency=None, cascade=False, restart=False):
+    """Grade [(student_id, image_path)] into the results store, resuming from the journal when possible.
+
+    workers=0 grades in this process (no pool). Returns a summary dict.
+    """
+    journal = Journal(journal_path or os.path.join(JOURNAL_DIR, f"{exam_id}.jsonl"))
+    key_hash = content_hash(json.dumps(answer_key, sort_keys=True))
+    if not restart and journal.load():
+        if journal.header.get("exam_id") != exam_id or journal.header.get("answer_key_hash") != key_hash:
+            raise ValueError(
+                f"Journal {journal.path} belongs to a different exam or answer key; "
+                "pass --restart to start a new run (or use regrade.py for key changes)."
+            )
+        log.info(f"↩️ Resuming run {journal.header['run_id']}: {len(journal.done)} sheets already graded")
+    else:
+        journal.start({"exam_id": exam_id, "run_id": new_run_id(), "answer_key_hash": key_hash, "started": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    run_id = journal.header["run_id"]
+    if use_stored_scoring_params(exam_id):
+        log.info(f"⚖️ Scoring with the parameters stored with the latest run of '{exam_id}'")
+
+    student_ids = {image_path: student_id for student_id, image_path in sheets}
+    pending = [path for _, path in sheets if journal.done.get(path) != file_hash(path)]
+    summary = {"run_id": run_id, "journal": journal.path, "skipped": len(sheets) - len(pending), "graded": 0, "failed": 0}
+    if not pending:
+        return summary
+
+    workers = default_workers() if workers is None else workers
+    ocr_concurrency = ocr_concurrency or max(1, TOTAL_OCR_CONCURRENCY // max(1, workers))
+    log.info(f"🚀 Grading {len(pending)} sheets with {workers or 'no'} worker processes (OCR concurrency {ocr_concurrency} each)")
+
+    started = time.perf_counter()
+    writer = ResultsWriter()
+
+    def record(graded):
+        finished = []
+        for sheet in graded:
+            if sheet["text_hash"] is None:
+                summary["failed"] += 1
+                log.warning(f"❌ No text for {os.path.basename(sheet['image'])}; it will be retried on the next run")
+                continue
+            sheet_name = os.path.basename(sheet["image"])
+            for q, result in sheet["marks"].items():
+                provenance = item_provenance(sheet["image_hash"], sheet["text_hash"], answer_key[q], sheet["answers"][q])
+                writer.add_result(exam_id, run_id, student_ids[sheet["image"]], sheet_name, q, result, provenance)
+            finished.append({"image": sheet["image"], "image_hash": sheet["image_hash"], "questions": len(sheet["marks"]),
+                             "timings": sheet["timings"], "duplicates": sheet["duplicates"]})
+        # Results first, journal second: a journaled sheet is always in the store
+        writer.flush()
+        journal.checkpoint(finished)
+        summary["graded"] += len(finished)
+        done = summary["graded"] + summary["failed"]
+        rate = done / (time.perf_counter() - started)
+        log.info(f"✅ {done}/{len(pending)} sheets ({rate:.2f} sheets/s)",
+                 extra={"fields": {"done": done, "total": len(pending), "sheets_per_s": rate}})
+
+    chunks = _chunks(pending, chunk_size)
+    if workers == 0:
+        for chunk in chunks:
+            record(grade_chunk(chunk, answer_key, ocr_concurrency, cascade))
+        return summary
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(threads_per_worker, similarity_scoring.scoring_params()))
+    try:
+        futures = {executor.submit(grade_chunk, chunk, answer_key, ocr_concurrency, cascade) for chunk in chunks}
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                record(future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="folder of answer sheet images")
+    source.add_argument("--manifest", help="file listing the sheets to grade")
+    parser.add_argument("--answer-key", default="answer_key.json")
+    parser.add_argument("--exam-id", default=os.getenv("EXAM_ID", "default"))
+    parser.add_argument("--journal", help=f"checkpoint file (default: {JOURNAL_DIR}/<exam-id>.jsonl)")
+    parser.add_argument("--workers", type=int, help="grading processes (default: fit cores and memory; 0 = in-process)")
+    parser.add_argument("--memory-per-worker-gb", type=float, default=MEMORY_PER_WORKER_GB)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--ocr-concurrency", type=int, help="Gemini requests in flight per worker")
+    parser.add_argument("--cascade", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="ignore the journal and start a new run")
+    args = parser.parse_args()
+
+    configure_logging()
+    from main import find_images, load_answer_key
+
+    answer_key = load_answer_key(args.answer_key)
+    if not answer_key:
+        parser.error(f"answer key '{args.answer_key}' not found")
+    if args.manifest:
+        sheets = read_manifest(args.manifest)
+    else:
+        sheets = [(os.path.splitext(os.path.basename(path))[0], path) for path in find_images(args.input)]
+    if not sheets:
+        parser.error("no answer sheets found")
+
+    workers = args.workers if args.workers is not None else default_workers(args.memory_per_worker_gb)
+    try:
+        summary = batch_grade(sheets, answer_key, args.exam_id, journal_path=args.journal, workers=workers,
+                              chunk_size=args.chunk_size, ocr_concurrency=args.ocr_concurrency,
+                              cascade=args.cascade, restart=args.restart)
+    except KeyboardInterrupt:
+        print("\n⏸️ Interrupted; rerun the same command to resume.")
+        return
+
+    print(f"🏁 Run {summary['run_id']} of exam '{args.exam_id}': {summary['graded']} graded, "
+          f"{summary['skipped']} already done, {summary['failed']} failed (journal: {summary['journal']})")
+    write_metrics()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Multi-page answer booklets (PDF and multi-page TIFF), decoded one page at a time.
+
+Pages are yielded as PNG bytes and each one is released before the next is
+decoded, so a long scan never sits in memory as a whole. TIFF pages are
+read with Pillow; PDF pages are rendered with pypdfium2, an optional
+dependency (pip install pypdfium2). PDFium is not thread-safe, so calls into
+it are serialized by a module-wide lock that is released between pages.
+"""
+import io
+import os
+import threading
+from PIL import Image, ImageSequence
+
+DOCUMENT_EXTENSIONS = (".pdf", ".tif", ".tiff")
+PDF_RENDER_DPI = 200  # Enough for handwriting; the OCR preprocessing shrinks pages afterwards anyway
+
+_SIGNATURES = {b"%PDF": "pdf", b"II*\x00": "tiff", b"MM\x00*": "tiff"}
+# PDFium is not thread-safe: every call into it, across all open documents, goes through this lock
+_pdfium_lock = threading.Lock()
+
+
+def _header(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:4])
+    if hasattr(source, "read"):
+        # From the start, whatever has been read already, leaving the stream where it was
+        position = source.tell()
+        source.seek(0)
+        header = source.read(4)
+        source.seek(position)
+        return header
+    with open(source, "rb") as f:
+        return f.read(4)
+
+
+def document_kind(source):
+    """"pdf" or "tiff" for a multi-page capable document (path, bytes or file-like), else None."""
+    if isinstance(source, (str, os.PathLike)) and not str(source).lower().endswith(DOCUMENT_EXTENSIONS):
+        return None
+    return _SIGNATURES.get(_header(source))
+
+
+def _open(source):
+    """Something Pillow and pypdfium2 can read lazily: the path itself, or a seekable stream."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _png_bytes(image):
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def _iter_tiff_pages(source):
+    with Image.open(_open(source)) as tiff:
+        for frame in ImageSequence.Iterator(tiff):
+            yield _png_bytes(frame)
+
+
+def _iter_pdf_pages(source):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as e:
+        raise ImportError("Reading PDF booklets needs pypdfium2: pip install pypdfium2") from e
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(_open(source))
+        page_count = len(pdf)
+    try:
+        for i in range(page_count):
+            # Held per page only, so other threads can decode between the pages of this booklet
+            with _pdfium_lock:
+                page = pdf[i]
+                try:
+                    bitmap = page.render(scale=PDF_RENDER_DPI / 72)
+                    image = bitmap.to_pil()
+                finally:
+                    page.close()
+            try:
+                png = _png_bytes(image)
+            finally:
+                # The image may share the bitmap's buffer, and freeing the bitmap is a PDFium call too
+                del image
+                with _pdfium_lock:
+                    bitmap.close()
+            yield png
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+
+def iter_pages(source):
+    """PNG bytes of each page of a PDF or TIFF booklet, in order, decoded lazily."""
+    kind = document_kind(source)
+    if kind == "pdf":
+        return _iter_pdf_pages(source)
+    if kind == "tiff":
+        return _iter_tiff_pages(source)
+    raise ValueError("Not a PDF or TIFF document.")
@@ -0,0 +1,213 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from instrumentation import CACHE_LOOKUPS
+
+# Root directory of the on-disk store (one sub-directory per model)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings"))
+# Number of embeddings kept in the in-process LRU on top of the memory map
+EMBEDDING_LRU_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", "4096"))
+
+MATRIX_FILE = "embeddings.f32"
+INDEX_FILE = "index.tsv"
+META_FILE = "meta.json"
+LOCK_FILE = "append.lock"
+
+
+@contextlib.contextmanager
+def _exclusive_lock(path):
+    """Inter-process exclusive lock on `path`, held for the duration of the block."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def normalize_text(text):
+    """Normalize text before hashing so trivially different copies share an entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text):
+    """Content hash of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only float32 embedding matrix on disk for one model.
+
+    Layout of the model directory:
+      embeddings.f32  raw float32 rows, memory-mapped for reads
+      index.tsv       one "<text hash>\\t<row>" line per stored embedding
+      meta.json       model name and embedding dimension
+      append.lock     held (flock) by whichever process is appending
+
+    Rows are only ever appended, so other processes and later runs can
+    reuse everything written so far. A small LRU sits in front of the
+    memory map for the hottest vectors.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR, lru_size=EMBEDDING_LRU_SIZE):
+        self.model_name = model_name
+        self.directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.lru_size = lru_size
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._index_offset = 0
+        self._matrix = None
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """Read the meta and index files written by this or earlier processes."""
+        if os.path.exists(self._path(META_FILE)):
+            with open(self._path(META_FILE), encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        self._refresh_index()
+
+    def _refresh_index(self):
+        if not os.path.exists(self._path(INDEX_FILE)) or self.dim is None:
+            return
+        row_bytes = self.dim * 4
+        stored_rows = os.path.getsize(self._path(MATRIX_FILE)) // row_bytes if os.path.exists(self._path(MATRIX_FILE)) else 0
+        # Only read index lines appended since the last refresh
+        with open(self._path(INDEX_FILE), "rb") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn write from a concurrent process; re-read it next time
+                self._index_offset += len(line)
+                parts = line.decode("utf-8").rstrip("\n").split("\t")
+                if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < stored_rows:
+                    self._index[parts[0]] = int(parts[1])
+        self._matrix = np.memmap(self._path(MATRIX_FILE), dtype=np.float32, mode="r", shape=(stored_rows, self.dim)) if stored_rows else None
+
+    def _lru_put(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        row = self._index.get(key)
+        if row is None or self._matrix is None or row >= self._matrix.shape[0]:
+            return None
+        vector = np.array(self._matrix[row])
+        self._lru_put(key, vector)
+        return vector
+
+    def get(self, text):
+        """Cached embedding for `text`, or None."""
+        with self._lock:
+            return self._lookup(text_hash(text))
+
+    def put_many(self, texts, embeddings):
+        """Append embeddings for texts that are not stored yet."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        # The thread lock guards this object; the file lock serializes appends across processes
+        with self._lock, _exclusive_lock(self._path(LOCK_FILE)):
+            if self.dim is None:
+                self._load()  # Another process may have created the store meanwhile
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                with open(self._path(META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match cached dimension {self.dim}.")
+            self._refresh_index()  # Skip texts other processes stored since our last read
+
+            new_rows = {}
+            for text, vector in zip(texts, embeddings):
+                key = text_hash(text)
+                self._lru_put(key, vector)
+                if key not in self._index and key not in new_rows:
+                    new_rows[key] = vector
+            if not new_rows:
+                return
+
+            # Matrix first, index second: an index line never points at missing data
+            row_bytes = self.dim * 4
+            with open(self._path(MATRIX_FILE), "ab") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size % row_bytes:
+                    f.truncate(size - size % row_bytes)  # Drop a torn row left by a crashed writer
+                first_row = size // row_bytes
+                f.write(np.stack(list(new_rows.values())).tobytes())
+            with open(self._path(INDEX_FILE), "a", encoding="utf-8") as f:
+                for offset, key in enumerate(new_rows):
+                    f.write(f"{key}\t{first_row + offset}\n")
+            self._refresh_index()
+
+    def encode(self, texts, encode_fn, cache=True):
+        """Return embeddings for `texts`, calling `encode_fn` only on cache misses.
+
+        `encode_fn` receives a list of unique uncached texts and returns a 2-D
+        array. With `cache=False` misses are encoded but not written to disk.
+        """
+        texts = list(texts)
+        vectors = [self.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        hits = len(texts) - sum(vector is None for vector in vectors)
+        self.hits += hits
+        self.misses += len(missing)
+        CACHE_LOOKUPS.inc(hits, cache="embedding", result="hit")
+        CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+
+        if missing:
+            encoded = np.asarray(encode_fn(missing), dtype=np.float32)
+            if cache:
+                self.put_many(missing, encoded)
+            by_text = dict(zip(missing, encoded))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        return np.stack(vectors) if vectors else np.empty((0, self.dim or 0), dtype=np.float32)
+
+    def stats(self):
+        """Hit/miss counters and number of stored embeddings."""
+        return {"hits": self.hits, "misses": self.misses, "stored": len(self._index)}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model_name, cache_dir=EMBEDDING_CACHE_DIR):
+    """Shared EmbeddingStore for a model within this process."""
+    key = (model_name, cache_dir)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(model_name, cache_dir)
+        return _stores[key]
@@ -0,0 +1,351 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from instrumentation import API_CALLS, TOKENS, get_logger, span
+from retry import MAX_RETRIES, call_with_retries, is_retryable_error
+
+log = get_logger("gemini_evaluator")
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get API key and model name from environment variables
+API_KEY = os.getenv("API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "gemini-pro-vision")
+
+DEFAULT_MAX_CONCURRENCY = 4
+MAX_PARSE_RETRIES = 1  # A malformed structured reply is rare but worth one more paid attempt
+
+# Packing policy for multi-question requests
+MAX_PAIRS_PER_REQUEST = 10
+MAX_PROMPT_TOKENS = 6000
+CHARS_PER_TOKEN = 4  # Rough estimate; good enough for packing decisions
+
+RUBRIC = """Please provide:
+
+A semantic similarity score as a percentage from 0 to 100.
+
+The score should reflect how much of the correct answer's meaning is captured in the student's answer.
+
+The score must increase gradually as the student includes more concepts or ideas from the correct answer — this is partial scoring, not all-or-nothing.
+
+Do not give high marks just because keywords are similar. Only increase marks when the student expresses the correct ideas, even in different words.
+
+If the student partially explains the correct answer, give a medium score (e.g., 30–70%) depending on how much is covered.
+
+If the meaning is mostly accurate, give a high score (e.g., 80–100%).
+
+If the meaning is completely wrong or missing, then give a low score (e.g., 0–20%).
+
+A brief explanation focusing on what parts were correct and what concepts were missing. Explain why the score was given, as if you're providing helpful, constructive feedback to a student.
+
+A list of the key missing concepts from the correct answer that the student did not include or misunderstood."""
+
+# Structured output: the model must reply with exactly this JSON object
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "NUMBER"},
+        "explanation": {"type": "STRING"},
+        "missing_concepts": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["score", "explanation", "missing_concepts"],
+}
+
+
+# Multi-question requests reply with one object per question, tagged with its id
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"id": {"type": "INTEGER"}, **RESPONSE_SCHEMA["properties"]},
+        "required": ["id", *RESPONSE_SCHEMA["required"]],
+    },
+}
+
+
+class EvaluationParseError(ValueError):
+    """The model's reply did not match RESPONSE_SCHEMA."""
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Return the shared Gemini client configured for JSON output, creating it on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            if not API_KEY:
+                raise ValueError("API Key not found in .env file. Please add your API_KEY to the .env file.")
+
+            import google.generativeai as genai
+
+            genai.configure(api_key=API_KEY)
+            _model = genai.GenerativeModel(
+                MODEL_NAME,
+                generation_config={"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA},
+            )
+        return _model
+
+
+def build_prompt(correct_answer, student_answer):
+    """Prompt for a single (correct, student) pair."""
+    return f"""I need you to evaluate the similarity between these two sentences:
+
+CORRECT ANSWER: "{correct_answer}"
+
+STUDENT ANSWER: "{student_answer}"
+
+{RUBRIC}
+
+Reply with a JSON object with the keys "score", "explanation" and "missing_concepts"."""
+
+
+def _parse_json(response_text):
+    """Decode a JSON reply, tolerating a Markdown code fence around it."""
+    fenced = re.match(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", response_text, re.DOTALL)
+    try:
+        return json.loads(fenced.group(1) if fenced else response_text)
+    except json.JSONDecodeError as e:
+        raise EvaluationParseError(f"Reply is not valid JSON: {e}") from e
+
+
+def _to_result(data, response_text):
+    """Validate one decoded evaluation object and convert it to the app's result dict."""
+    if not isinstance(data, dict) or not {"score", "explanation", "missing_concepts"} <= data.keys():
+        raise EvaluationParseError("Reply does not contain score, explanation and missing_concepts.")
+    try:
+        score = min(100.0, max(0.0, float(data["score"])))
+    except (TypeError, ValueError) as e:
+        raise EvaluationParseError(f"Score is not a number: {data['score']!r}") from e
+
+    missing_concepts = data["missing_concepts"]
+    if isinstance(missing_concepts, list):
+        missing_concepts = "\n".join(f"- {concept}" for concept in missing_concepts) or "None identified."
+
+    return {
+        "Score": score,
+        "Explanation": str(data["explanation"]) or "No explanation provided.",
+        "Missing Concepts": missing_concepts,
+        "Full Response": response_text,
+    }
+
+
+def parse_evaluation(response_text):
+    """Parse a structured reply in one pass; raises EvaluationParseError if it is malformed."""
+    return _to_result(_parse_json(response_text), response_text)
+
+
+def _error_result(error):
+    return {
+        "Score": 0,
+        "Explanation": f"Error: {str(error)}",
+        "Missing Concepts": "Evaluation failed",
+        "Full Response": "Error occurred",
+        "Error": str(error),
+    }
+
+
+def _retry_predicate(max_parse_retries=MAX_PARSE_RETRIES):
+    """Retry predicate for one evaluation: transient API errors, plus at most `max_parse_retries` parse errors."""
+    parse_errors = 0
+
+    def should_retry(error):
+        nonlocal parse_errors
+        if isinstance(error, EvaluationParseError):
+            parse_errors += 1
+            return parse_errors <= max_parse_retries
+        return is_retryable_error(error)
+
+    return should_retry
+
+
+def _generate(model, prompt, **kwargs):
+    """One Gemini request, counted and timed."""
+    TOKENS.observe(estimate_tokens(prompt), kind="evaluation_prompt")
+    try:
+        with span("gemini_request"):
+            response = model.generate_content(prompt, **kwargs)
+    except Exception:
+        API_CALLS.inc(api="evaluate", outcome="error")
+        raise
+    API_CALLS.inc(api="evaluate", outcome="ok")
+    return response
+
+
+def evaluate_similarity(correct_answer, student_answer, model=None, max_retries=MAX_RETRIES):
+    """Evaluate one pair with Gemini; failures come back as a zero-score result with an "Error" key."""
+    try:
+        model = model or get_model()
+        prompt = build_prompt(correct_answer, student_answer)
+        return call_with_retries(
+            lambda: parse_evaluation(_generate(model, prompt).text),
+            max_retries=max_retries, label="Gemini evaluation", retryable=_retry_predicate(), operation="evaluate",
+        )
+    except Exception as e:
+        log.error(f"❌ Error in Gemini evaluation: {e}")
+        return _error_result(e)
+
+
+def iter_evaluations(pairs, max_concurrency=DEFAULT_MAX_CONCURRENCY, model=None, max_retries=MAX_RETRIES):
+    """Evaluate (correct, student) pairs on a bounded thread pool, yielding (index, result) as each completes."""
+    pairs = list(pairs)
+    try:
+        model = model or get_model()
+    except Exception as e:
+        for i in range(len(pairs)):
+            yield i, _error_result(e)
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(evaluate_similarity, correct, student, model, max_retries): i
+            for i, (correct, student) in enumerate(pairs)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def evaluate_many(pairs, max_concurrency=DEFAULT_MAX_CONCURRENCY, model=None, max_retries=MAX_RETRIES):
+    """Evaluate many pairs concurrently and return the results in input order."""
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    for i, result in iter_evaluations(pairs, max_concurrency=max_concurrency, model=model, max_retries=max_retries):
+        results[i] = result
+    return results
+
+
+def estimate_tokens(text):
+    """Cheap prompt-size estimate used to pack questions into requests."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _question_block(question_id, correct_answer, student_answer):
+    return f"""QUESTION {question_id}
+CORRECT ANSWER: "{correct_answer}"
+STUDENT ANSWER: "{student_answer}"
+"""
+
+
+def build_batch_header():
+    """Rubric shared by every question of a multi-question request."""
+    return f"""I need you to evaluate the similarity between the correct answer and the student answer of each question below, independently of the other questions.
+
+For each question:
+
+{RUBRIC}
+
+Reply with a JSON array containing one object per question with the keys "id" (the question number), "score", "explanation" and "missing_concepts".
+"""
+
+
+def build_batch_prompt(pairs, question_ids):
+    """Prompt packing several (correct, student) pairs behind one rubric header."""
+    blocks = [_question_block(qid, correct, student) for qid, (correct, student) in zip(question_ids, pairs)]
+    return build_batch_header() + "\n" + "\n".join(blocks)
+
+
+def pack_pairs(pairs, max_pairs=MAX_PAIRS_PER_REQUEST, max_tokens=MAX_PROMPT_TOKENS):
+    """Greedily group pair indices into requests under the max-pairs / max-tokens policy.
+
+    A pair that alone exceeds max_tokens still gets a request of its own.
+    """
+    header_tokens = estimate_tokens(build_batch_header())
+    batches, current, current_tokens = [], [], header_tokens
+    for i, (correct, student) in enumerate(pairs):
+        pair_tokens = estimate_tokens(_question_block(i + 1, correct, student))
+        if current and (len(current) >= max_pairs or current_tokens + pair_tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], header_tokens
+        current.append(i)
+        current_tokens += pair_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_evaluation(response_text, question_ids):
+    """Parse a multi-question reply into {question id: result}.
+
+    Entries that are missing or malformed are left out so the caller can
+    re-ask for just those questions; an undecodable reply raises
+    EvaluationParseError.
+    """
+    data = _parse_json(response_text)
+    if not isinstance(data, list):
+        raise EvaluationParseError("Batch reply is not a JSON array.")
+
+    wanted = set(question_ids)
+    results = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            question_id = int(item.get("id"))
+            if question_id in wanted and question_id not in results:
+                results[question_id] = _to_result(item, json.dumps(item))
+        except (TypeError, ValueError):
+            continue  # Includes EvaluationParseError for this entry
+    return results
+
+
+def _evaluate_batch(pairs, indices, model, max_retries):
+    """One multi-question request; questions it fails to answer fall back to per-pair requests."""
+    question_ids = list(range(1, len(indices) + 1))
+    batch_pairs = [pairs[i] for i in indices]
+    prompt = build_batch_prompt(batch_pairs, question_ids)
+    generation_config = {"response_mime_type": "application/json", "response_schema": BATCH_RESPONSE_SCHEMA}
+
+    try:
+        response = call_with_retries(
+            lambda: _generate(model, prompt, generation_config=generation_config),
+            max_retries=max_retries, label=f"Gemini batch of {len(indices)}", operation="evaluate",
+        )
+        parsed = parse_batch_evaluation(response.text, question_ids)
+    except Exception as e:
+        log.warning(f"⚠️ Batch evaluation failed ({e}); falling back to per-question requests")
+        parsed = {}
+
+    results = {}
+    for qid, i in zip(question_ids, indices):
+        if qid in parsed:
+            results[i] = parsed[qid]
+        else:
+            results[i] = evaluate_similarity(*pairs[i], model=model, max_retries=max_retries)
+    return results
+
+
+def iter_batched_evaluations(pairs, max_pairs=MAX_PAIRS_PER_REQUEST, max_tokens=MAX_PROMPT_TOKENS,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY, model=None, max_retries=MAX_RETRIES):
+    """Evaluate pairs in packed multi-question requests, yielding (index, result) as each request completes."""
+    pairs = list(pairs)
+    try:
+        model = model or get_model()
+    except Exception as e:
+        for i in range(len(pairs)):
+            yield i, _error_result(e)
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [
+            executor.submit(_evaluate_batch, pairs, indices, model, max_retries)
+            for indices in pack_pairs(pairs, max_pairs=max_pairs, max_tokens=max_tokens)
+        ]
+        for future in as_completed(futures):
+            yield from future.result().items()
+
+
+def evaluate_batched(pairs, max_pairs=MAX_PAIRS_PER_REQUEST, max_tokens=MAX_PROMPT_TOKENS,
+                     max_concurrency=DEFAULT_MAX_CONCURRENCY, model=None, max_retries=MAX_RETRIES):
+    """Evaluate many pairs with as few requests as the packing policy allows; results in input order."""
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    for i, result in iter_batched_evaluations(pairs, max_pairs=max_pairs, max_tokens=max_tokens,
+                                              max_concurrency=max_concurrency, model=model, max_retries=max_retries):
+        results[i] = result
+    return results
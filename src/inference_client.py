@@ -0,0 +1,75 @@
+import json
+import os
+import urllib.error
+import urllib.request
+from dotenv import load_dotenv
+from segregator import segregate_ocr_text
+
+# Load environment variables
+load_dotenv()
+
+# URL of a running inference_server; when unset, models are loaded in this process
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL")
+REQUEST_TIMEOUT = 300  # seconds
+
+
+class InferenceServerError(RuntimeError):
+    """The inference server rejected a request or could not be reached."""
+
+
+def _post(endpoint, payload):
+    request = urllib.request.Request(
+        INFERENCE_SERVER_URL.rstrip("/") + endpoint,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise InferenceServerError(json.loads(e.read() or b"{}").get("error", str(e))) from e
+    except urllib.error.URLError as e:
+        raise InferenceServerError(f"Inference server at {INFERENCE_SERVER_URL} is unreachable: {e.reason}") from e
+
+
+def server_health():
+    """Batching stats from the server, or None when running in-process or unreachable."""
+    if not INFERENCE_SERVER_URL:
+        return None
+    try:
+        with urllib.request.urlopen(INFERENCE_SERVER_URL.rstrip("/") + "/health", timeout=5) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def compute_similarity_and_marks_batch(pairs, cascade=False):
+    """Same contract as similarity_scoring.compute_similarity_and_marks_batch, served remotely when configured."""
+    pairs = [[correct, student] for correct, student in pairs]
+    if not INFERENCE_SERVER_URL:
+        import similarity_scoring
+        return similarity_scoring.compute_similarity_and_marks_batch(pairs, cascade=cascade)
+    if not pairs:
+        return []
+    return _post("/score", {"pairs": pairs, "cascade": cascade})["results"]
+
+
+def compute_similarity_and_marks(correct_answer, student_answer):
+    """Score a single pair (micro-batched with other sessions when served remotely)."""
+    if not INFERENCE_SERVER_URL:
+        import similarity_scoring
+        return similarity_scoring.compute_similarity_and_marks(correct_answer, student_answer)
+    return compute_similarity_and_marks_batch([(correct_answer, student_answer)])[0]
+
+
+def preprocess_answers(answers_dict):
+    """Same contract as tokenizer.preprocess_answers, served remotely when configured."""
+    if not INFERENCE_SERVER_URL:
+        import tokenizer
+        return tokenizer.preprocess_answers(answers_dict)
+    return _post("/preprocess", {"sheets": [answers_dict]})["sheets"][0]
+
+
+def analyse_text(text):
+    """Segregate OCR text locally, then lemmatize the answers via the shared spaCy pipeline."""
+    return preprocess_answers(segregate_ocr_text(text))
@@ -0,0 +1,197 @@
+"""Shared local inference service for the scoring models and the spaCy pipeline.
+
+One process per host owns the models; Streamlit sessions and workers talk to
+it through inference_client. Concurrent requests are gathered into
+micro-batches so the models see one large batch instead of many tiny ones.
+
+Usage (from the repository root):
+    python src/inference_server.py [--host 127.0.0.1] [--port 8765] [--max-batch 64] [--max-wait-ms 10]
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from instrumentation import render_prometheus
+from model_registry import model_stats
+from similarity_scoring import compute_similarity_and_marks_batch, warmup
+from tokenizer import preprocess_answer_sheets
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 64  # Pairs (or answer sheets) per model call
+DEFAULT_MAX_WAIT = 0.01  # Seconds to wait for more requests once one has arrived
+
+
+class MicroBatcher:
+    """Collects items from concurrent callers and runs them through `batch_fn` together.
+
+    Each submitted request is a list of items; the worker waits for the first
+    request, then keeps gathering until `max_batch` items are queued or
+    `max_wait` seconds have passed, calls batch_fn once on everything, and
+    hands each caller back its own slice of the results.
+    """
+
+    def __init__(self, batch_fn, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, items):
+        """Queue a request; returns a Future resolving to its list of results."""
+        future = Future()
+        self._queue.put((list(items), future))
+        return future
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            items = [item for request_items, _ in requests for item in request_items]
+            try:
+                results = self.batch_fn(items) if items else []
+            except Exception as e:
+                if len(requests) == 1:
+                    requests[0][1].set_exception(e)
+                    continue
+                # Rerun the requests one by one so a bad one does not fail the others batched with it
+                for request_items, future in requests:
+                    try:
+                        future.set_result(self.batch_fn(request_items))
+                    except Exception as request_error:
+                        future.set_exception(request_error)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            offset = 0
+            for request_items, future in requests:
+                future.set_result(results[offset:offset + len(request_items)])
+                offset += len(request_items)
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items, "mean_batch": self.items / self.batches if self.batches else 0.0}
+
+
+def _to_json_scores(result):
+    """Scoring dicts hold NumPy scalars; make them JSON-serializable."""
+    return {key: (value if value is None or isinstance(value, str) else float(value)) for key, value in result.items()}
+
+
+def make_batchers(max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+    """One batcher per model family: plain scoring, cascade scoring and spaCy preprocessing."""
+    return {
+        "score": MicroBatcher(lambda pairs: compute_similarity_and_marks_batch(pairs), max_batch, max_wait),
+        "score_cascade": MicroBatcher(lambda pairs: compute_similarity_and_marks_batch(pairs, cascade=True), max_batch, max_wait),
+        "preprocess": MicroBatcher(preprocess_answer_sheets, max_batch, max_wait),
+    }
+
+
+def _check_pairs(pairs):
+    """[(correct, student)] from a /score request body; raises ValueError if it is malformed."""
+    if not isinstance(pairs, list) or not all(
+            isinstance(pair, list) and len(pair) == 2 and all(isinstance(text, str) for text in pair) for pair in pairs):
+        raise ValueError('"pairs" must be a list of [correct, student] string pairs')
+    return [tuple(pair) for pair in pairs]
+
+
+def _check_sheets(sheets):
+    """Answer sheets from a /preprocess request body; raises ValueError if it is malformed."""
+    if not isinstance(sheets, list) or not all(
+            isinstance(sheet, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in sheet.items())
+            for sheet in sheets):
+        raise ValueError('"sheets" must be a list of {question: answer} string objects')
+    return sheets
+
+
+def make_handler(batchers):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "batchers": {name: b.stats() for name, b in batchers.items()},
+                                      "models": model_stats()})
+            elif self.path == "/metrics":
+                body = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/score":
+                    batcher = batchers["score_cascade" if request.get("cascade") else "score"]
+                    results = batcher.submit(_check_pairs(request["pairs"])).result()
+                    self._send_json(200, {"results": [_to_json_scores(result) for result in results]})
+                elif self.path == "/preprocess":
+                    self._send_json(200, {"sheets": batchers["preprocess"].submit(_check_sheets(request["sheets"])).result()})
+                else:
+                    self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, {"error": f"Bad request: {e}"})
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass  # Keep the console for startup / error messages
+
+    return InferenceHandler
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+    """Load the models once and serve scoring / preprocessing requests until interrupted."""
+    print("⏳ Loading models...")
+    warmup()
+    preprocess_answer_sheets([{"1": "warm up"}])
+
+    server = ThreadingHTTPServer((host, port), make_handler(make_batchers(max_batch, max_wait)))
+    print(f"🚀 Inference server listening on http://{host}:{port} (max batch {max_batch}, max wait {max_wait * 1000:.0f} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT * 1000)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms / 1000)
@@ -0,0 +1,278 @@
+"""Lightweight timing, metrics and structured logging for the grading pipeline.
+
+    with span("ocr", key=image_name):   # or @span("segregate") on a function
+        ...
+    API_CALLS.inc(api="ocr", outcome="ok")
+
+Spans feed the grading_stage_seconds histogram and a DEBUG log record;
+counters and histograms can be rendered in Prometheus text format, written
+to METRICS_FILE or served on METRICS_PORT. Logs go through the standard
+logging module as plain messages, or as JSON lines with LOG_FORMAT=json.
+Metrics live in the current process only (process-pool workers are not
+aggregated).
+"""
+import bisect
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+METRICS_FILE = os.getenv("METRICS_FILE")  # Prometheus text file written by write_metrics()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_registry = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = [*label_key, *extra]
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """Current value per label set."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def summary(self, **labels):
+        """{"count", "sum", "mean"} for one label set."""
+        counts, total = self._values.get(_label_key(labels), ([0], 0.0))
+        count = sum(counts)
+        return {"count": count, "sum": total, "mean": total / count if count else 0.0}
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, (("le", str(bound)),), cumulative))
+                samples.append((f"{self.name}_sum", key, (), total))
+                samples.append((f"{self.name}_count", key, (), cumulative))
+        return samples
+
+
+def _register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name, help_text):
+    """Get or create the counter `name`."""
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text):
+    """Get or create the gauge `name`."""
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    """Get or create the histogram `name`."""
+    return _register(Histogram(name, help_text, buckets))
+
+
+# Metrics shared across modules
+STAGE_SECONDS = histogram("grading_stage_seconds", "Wall time of pipeline stages, per item or batch")
+API_CALLS = counter("grading_api_calls_total", "Gemini requests by API and outcome")
+RETRIES = counter("grading_retries_total", "Retried requests by operation")
+CACHE_LOOKUPS = counter("grading_cache_lookups_total", "Cache lookups by cache and result")
+TOKENS = histogram("grading_tokens", "Estimated tokens per request or answer, by kind", TOKEN_BUCKETS)
+
+_log = logging.getLogger("grading.spans")
+
+
+class span(contextlib.ContextDecorator):
+    """Time a block (or, as a decorator, every call) and record it under `stage`.
+
+    `labels` become histogram labels and must stay low-cardinality; `key`
+    (e.g. an image name) only goes to the log. `.seconds` is set on exit.
+    """
+
+    def __init__(self, stage, key=None, **labels):
+        self.stage = stage
+        self.key = key
+        self.labels = labels
+        self.seconds = None
+
+    def _recreate_cm(self):
+        # A fresh span per decorated call, so concurrent calls do not share timers
+        return span(self.stage, self.key, **self.labels)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        STAGE_SECONDS.observe(self.seconds, stage=self.stage, **self.labels)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("span", extra={"fields": {
+                "stage": self.stage, "key": self.key, "seconds": round(self.seconds, 6),
+                "error": exc_type.__name__ if exc_type else None, **self.labels,
+            }})
+        return False
+
+
+def render_prometheus():
+    """All metrics of this process in Prometheus text exposition format."""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, extra, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path=None):
+    """Write render_prometheus() atomically to `path` (default METRICS_FILE); no-op without a path."""
+    path = path or METRICS_FILE
+    if not path:
+        return None
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+    return path
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serve GET /metrics on a daemon thread (default METRICS_PORT); returns the server or None."""
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any `fields` passed via `extra`."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level=None, fmt=None):
+    """Send the "grading" loggers to stdout as plain messages or JSON lines (idempotent)."""
+    logger = logging.getLogger("grading")
+    logger.setLevel((level or LOG_LEVEL).upper())
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def get_logger(module_name):
+    """Logger for a pipeline module, under the "grading" hierarchy."""
+    return logging.getLogger(f"grading.{module_name}")
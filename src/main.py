@@ -1,46 +1,117 @@
 import os
 import glob
-from scanner import process_image
-from segregator import segregate_ocr_text
+import json
+from instrumentation import configure_logging, get_logger, start_metrics_server, write_metrics
+from scanner import ocr_cache_stats
 from tokenizer import preprocess_answers  # Tokenization & Lemmatization
+from similarity_scoring import cache_reference_embeddings
+from pipeline import grade_sheets  # OCR → segregation → lemmatization → scoring
+from answer_index import AnswerIndex
+from documents import DOCUMENT_EXTENSIONS
+from results_store import ResultsWriter, content_hash, file_hash, new_run_id
+from regrade import item_provenance, use_stored_scoring_params
 
 IMAGE_FOLDER = "answers"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp") + DOCUMENT_EXTENSIONS  # PDF / TIFF booklets count as one sheet
+ANSWER_KEY_FILE = "answer_key.json"  # Optional {"question number": "key answer"} mapping
+EXAM_ID = os.getenv("EXAM_ID", "default")  # Partition of the results store this run writes to
+
+log = get_logger("main")
+
+
+def load_answer_key(path=ANSWER_KEY_FILE):
+    """Load and preprocess the answer key, or return None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return preprocess_answers(json.load(f))
+
+
+def find_images(folder=IMAGE_FOLDER):
+    """Answer sheet images and booklets in `folder`, sorted by name."""
+    return sorted(f for f in glob.glob(os.path.join(folder, "*")) if f.lower().endswith(IMAGE_EXTENSIONS))
+
 
 def main():
+    configure_logging()
+    start_metrics_server()
+
     if not os.path.exists(IMAGE_FOLDER):
-        print(f"⚠️ Folder '{IMAGE_FOLDER}' not found. Please check the path.")
+        log.warning(f"⚠️ Folder '{IMAGE_FOLDER}' not found. Please check the path.")
         return
     
-    image_files = glob.glob(os.path.join(IMAGE_FOLDER, "*"))
-    image_files = [f for f in image_files if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+    image_files = find_images(IMAGE_FOLDER)
 
     if not image_files:
-        print(f"⚠️ No valid images found in folder '{IMAGE_FOLDER}'.")
+        log.warning(f"⚠️ No valid images found in folder '{IMAGE_FOLDER}'.")
         return
 
-    print(f"\n🔍 Found {len(image_files)} valid images.\n")
+    log.info(f"🔍 Found {len(image_files)} valid images.", extra={"fields": {"images": len(image_files)}})
 
-    for i, image_file in enumerate(image_files, start=1):
-        print(f"\n📸 Processing Image {i}/{len(image_files)}...")
-        
-        # Step 1: Extract text from image
-        extracted_text = process_image(image_file)
+    answer_key = load_answer_key()
+    if answer_key:
+        # Key answer embeddings are computed once per exam and reused across runs
+        cache_reference_embeddings(answer_key.values())
+        # Weights set by an earlier regrade of this exam stay in effect
+        if use_stored_scoring_params(EXAM_ID):
+            log.info(f"⚖️ Scoring with the parameters stored with the latest run of exam '{EXAM_ID}'")
 
-        if extracted_text:
-            print(f"\n📜 Extracted Text from {os.path.basename(image_file)}:\n{extracted_text}\n")
-            
-            # Step 2: Segregate into Q&A format
-            qa_dict = segregate_ocr_text(extracted_text)
+    run_id = new_run_id()
+    results_writer = ResultsWriter()
+    answer_index = AnswerIndex()  # Repeated answers are scored once per exam question
 
-            # Step 3: Tokenize & Lemmatize answers
-            processed_answers = preprocess_answers(qa_dict)
+    # Sheets stream out of the pipeline as soon as each one is graded
+    for i, sheet in enumerate(grade_sheets(image_files, answer_key, answer_index=answer_index), start=1):
+        image_file = sheet["image"]
+        timings = sheet["timings"]
+        log.info(f"📸 Processed Image {i}/{len(image_files)}: {os.path.basename(image_file)} "
+                 f"(OCR {timings['ocr'] or 0:.2f}s, NLP {timings['nlp']:.2f}s, scoring {timings['scoring']:.2f}s)",
+                 extra={"fields": {"sheet": os.path.basename(image_file), "done": i, "total": len(image_files), **timings}})
 
-            # Step 4: Print final processed answers
+        if sheet["text"]:
+            log.debug(f"📜 Extracted Text from {os.path.basename(image_file)}:\n{sheet['text']}",
+                      extra={"fields": {"sheet": os.path.basename(image_file)}})
+
+            # Print final processed answers
             print("\n📝 Final Processed Answers:")
-            for q, ans in processed_answers.items():
+            for q, ans in sheet["answers"].items():
                 print(f"Q{q}: {ans}")
 
+            # Print marks against the answer key
+            if sheet["marks"]:
+                print("\n📊 Marks:")
+                # Inputs recorded with each item let regrade.py recompute only what changes later
+                sheet_name = os.path.basename(image_file)
+                image_hash, text_hash = file_hash(image_file), content_hash(sheet["text"])
+                for q, result in sheet["marks"].items():
+                    print(f"Q{q}: {result['Marks Percentage']:.2f}%")
+                    provenance = item_provenance(image_hash, text_hash, answer_key[q], sheet["answers"][q])
+                    results_writer.add_result(EXAM_ID, run_id, os.path.splitext(sheet_name)[0], sheet_name, q, result, provenance)
+
+            for q, matches in sheet["duplicates"].items():
+                copies = ", ".join(f"{os.path.basename(path)} ({similarity:.2f})" for path, similarity in matches)
+                log.info(f"👯 Q{q} matches {copies}", extra={"fields": {
+                    "sheet": os.path.basename(image_file), "question": q,
+                    "matches": [[os.path.basename(str(path)), similarity] for path, similarity in matches]}})
+
         print("\n" + "=" * 60 + "\n")
 
+    results_writer.flush()
+    if answer_key:
+        log.info(f"💾 Results saved to the results store (exam '{EXAM_ID}', run {run_id})",
+                 extra={"fields": {"exam_id": EXAM_ID, "run_id": run_id}})
+
+    cache_stats = ocr_cache_stats()
+    log.info(f"♻️ OCR cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses", extra={"fields": cache_stats})
+    if answer_key:
+        reuse = answer_index.stats()
+        log.info(f"♻️ Duplicate answers: {reuse['reused']}/{reuse['pairs']} scores reused "
+                 f"({reuse['model_calls_avoided']} model calls avoided), {reuse['near_duplicates']} near-duplicates flagged",
+                 extra={"fields": reuse})
+
+    metrics_path = write_metrics()
+    if metrics_path:
+        log.info(f"📈 Metrics written to {metrics_path}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+import gc
+import os
+import threading
+import time
+from instrumentation import counter, gauge, get_logger, span
+
+# Process RSS the loaded models should stay under; least recently used models are
+# evicted (and reloaded on next use) when a load would exceed it. 0 = no budget.
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# Per-model profile overrides, e.g. "bi_encoder=bf16,cross_encoder_nli=small"
+MODEL_PROFILES = os.getenv("MODEL_PROFILES", "")
+DEFAULT_PROFILE = "default"
+
+MODEL_LOADS = counter("grading_model_loads_total", "Model loads by model (reloads after eviction included)")
+MODEL_EVICTIONS = counter("grading_model_evictions_total", "Models evicted to stay under the memory budget")
+MODEL_RESIDENT_BYTES = gauge("grading_model_resident_bytes", "RSS growth measured while loading each resident model")
+
+log = get_logger("model_registry")
+
+# Registered loaders and the models they produced, keyed by registry name
+_loaders = {}
+_profiles = {}  # name -> profiles its loader accepts (None: zero-argument loader)
+_selected_profiles = dict(entry.split("=", 1) for entry in MODEL_PROFILES.replace(" ", "").split(",") if "=" in entry)
+_models = {}
+_last_used = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _rss_bytes():
+    import psutil
+
+    return psutil.Process().memory_info().rss
+
+
+def _model_stats(name):
+    return _stats.setdefault(name, {"loads": 0, "evictions": 0, "resident_bytes": 0, "load_seconds": 0.0})
+
+
+def register_model(name, loader, profiles=None):
+    """Register a loader; the model is only built on first use.
+
+    Without `profiles` the loader takes no arguments. With a tuple of profile
+    names (e.g. ("default", "bf16", "small")) it is called with the selected
+    one, see set_profile() and MODEL_PROFILES.
+    """
+    with _lock:
+        _loaders[name] = loader
+        _profiles[name] = tuple(profiles) if profiles else None
+        _models.pop(name, None)
+        _model_stats(name)
+
+
+def model_profile(name):
+    """Profile the model registered under `name` is (or will be) loaded with."""
+    profile = _selected_profiles.get(name, DEFAULT_PROFILE)
+    if _profiles.get(name) and profile not in _profiles[name]:
+        raise ValueError(f"Unknown profile '{profile}' for model '{name}'. Choose from {', '.join(_profiles[name])}.")
+    return profile
+
+
+def set_profile(name, profile):
+    """Select a loading profile for `name`; a loaded model is dropped and reloaded on next use."""
+    if not _profiles.get(name) or profile not in _profiles[name]:
+        raise ValueError(f"Model '{name}' has no profile '{profile}'.")
+    with _lock:
+        _selected_profiles[name] = profile
+        _models.pop(name, None)
+
+
+def _evict(keep, extra_bytes=0):
+    """Drop least recently used models (never `keep`) until RSS plus `extra_bytes` fits the budget."""
+    budget = MODEL_MEMORY_BUDGET_MB * 2 ** 20
+    # Freed memory is not always handed back to the OS right away, so count what each eviction should release
+    projected = _rss_bytes() + extra_bytes
+    for victim in sorted((n for n in _models if n != keep), key=lambda n: _last_used.get(n, 0)):
+        if projected <= budget:
+            break
+        del _models[victim]
+        stats = _model_stats(victim)
+        stats["evictions"] += 1
+        projected -= stats["resident_bytes"]
+        MODEL_EVICTIONS.inc(model=victim)
+        MODEL_RESIDENT_BYTES.set(0, model=victim)
+        log.info(f"♻️ Evicted {victim} to stay under the {MODEL_MEMORY_BUDGET_MB:.0f} MB model memory budget")
+    gc.collect()
+
+
+def _load(name):
+    stats = _model_stats(name)
+    if MODEL_MEMORY_BUDGET_MB:
+        _evict(keep=name, extra_bytes=stats["resident_bytes"])  # Size known from an earlier load, if any
+
+    profile = model_profile(name)
+    rss_before = _rss_bytes()
+    with span("model_load", model=name) as timer:
+        model = _loaders[name](profile) if _profiles[name] else _loaders[name]()
+    _models[name] = model
+    stats["loads"] += 1
+    stats["resident_bytes"] = max(0, _rss_bytes() - rss_before)
+    stats["load_seconds"] = timer.seconds
+    MODEL_LOADS.inc(model=name)
+    MODEL_RESIDENT_BYTES.set(stats["resident_bytes"], model=name)
+    log.info(f"📦 Loaded {name} ({profile}) in {timer.seconds:.1f}s, +{stats['resident_bytes'] / 2 ** 20:.0f} MB RSS")
+
+    if MODEL_MEMORY_BUDGET_MB:
+        _evict(keep=name)
+    return model
+
+
+def get_model(name):
+    """Return the model registered under `name`, loading it if needed."""
+    _last_used[name] = time.monotonic()
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _lock:
+        if name not in _models:
+            if name not in _loaders:
+                raise KeyError(f"No model registered under '{name}'.")
+            return _load(name)
+        return _models[name]
+
+
+def is_loaded(name):
+    """Whether the model registered under `name` is currently in memory."""
+    return name in _models
+
+
+def unload_model(name):
+    """Drop a loaded model so it is rebuilt on next use."""
+    with _lock:
+        if _models.pop(name, None) is not None:
+            MODEL_RESIDENT_BYTES.set(0, model=name)
+    gc.collect()
+
+
+def registered_models():
+    """Names of all registered models."""
+    return list(_loaders)
+
+
+def model_stats():
+    """Process RSS, the memory budget, and per-model profile, residency, size and load/eviction counts.
+
+    "resident_mb" is the RSS growth measured during the model's last load.
+    """
+    return {
+        "rss_mb": _rss_bytes() / 2 ** 20,
+        "budget_mb": MODEL_MEMORY_BUDGET_MB or None,
+        "models": {
+            name: {
+                "profile": model_profile(name),
+                "loaded": name in _models,
+                "loads": stats["loads"],
+                "evictions": stats["evictions"],
+                "resident_mb": stats["resident_bytes"] / 2 ** 20,
+                "load_seconds": stats["load_seconds"],
+            }
+            for name, stats in _stats.items() if name in _loaders
+        },
+    }
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Location and limits of the on-disk OCR cache
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join(".cache", "ocr_cache.sqlite3"))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", str(30 * 24 * 3600)))  # seconds, 30 days
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 256 MB of text
+
+
+def cache_key(image_bytes, model_name, prompt):
+    """Content address of an OCR request: image bytes + model + prompt."""
+    digest = hashlib.sha256()
+    for part in (hashlib.sha256(image_bytes).digest(), str(model_name).encode("utf-8"), prompt.encode("utf-8")):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """SQLite-backed OCR text cache with TTL expiry and size-based LRU eviction.
+
+    SQLite handles locking, so the same file can be shared by the CLI, the
+    Streamlit app and several worker processes.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, ttl=OCR_CACHE_TTL, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # Commit on success, roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Cached text for `key`, or None if missing or expired."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT text, created FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE ocr_cache SET accessed = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row else None
+
+    def put(self, key, text):
+        """Store OCR text and evict expired / least recently used entries over the size limit."""
+        now = time.time()
+        size = len(text.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, text, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now),
+            )
+            conn.execute("DELETE FROM ocr_cache WHERE created < ?", (now - self.ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, old_size in conn.execute("SELECT key, size FROM ocr_cache ORDER BY accessed").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM ocr_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+
+    def stats(self):
+        """Hit/miss counters for this process plus the number of stored entries."""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide OCRCache using the configured path and limits."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OCRCache()
+        return _cache
@@ -0,0 +1,104 @@
+import os
+import re
+import numpy as np
+from instrumentation import get_logger
+
+# Exported (and optionally quantized) graphs are written here once and reused
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(".cache", "onnx"))
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+log = get_logger("onnx_backend")
+
+
+def _export_dir(model_name, quantize):
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+    return os.path.join(ONNX_CACHE_DIR, safe_name, "int8" if quantize else "fp32")
+
+
+def _session_options(num_threads):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    return options
+
+
+def _quantize(export_dir):
+    """Dynamic int8 quantization of the exported model.onnx, written next to it."""
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+    quantizer.quantize(save_dir=export_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False))
+
+
+def load_bi_encoder(model_name, quantize=False, num_threads=None):
+    """SentenceTransformer running on ONNX Runtime, exported to ONNX_CACHE_DIR on first use."""
+    from sentence_transformers import SentenceTransformer
+
+    export_dir = _export_dir(model_name, quantize)
+    onnx_dir = os.path.join(export_dir, "onnx")
+    file_name = QUANTIZED_FILE_NAME if quantize else "model.onnx"
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": _session_options(num_threads)}
+
+    if not os.path.exists(os.path.join(onnx_dir, file_name)):
+        log.info(f"📦 Exporting {model_name} to ONNX ({'int8' if quantize else 'fp32'})...",
+                 extra={"fields": {"model": model_name, "quantize": quantize}})
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(export_dir)
+        if quantize:
+            _quantize(onnx_dir)
+
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs={**model_kwargs, "file_name": f"onnx/{file_name}"})
+
+
+class OnnxCrossEncoder:
+    """Drop-in for sentence_transformers.CrossEncoder.predict on ONNX Runtime."""
+
+    def __init__(self, model_name, quantize=False, num_threads=None, max_length=None):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        export_dir = _export_dir(model_name, quantize)
+        file_name = QUANTIZED_FILE_NAME if quantize else "model.onnx"
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            log.info(f"📦 Exporting {model_name} to ONNX ({'int8' if quantize else 'fp32'})...",
+                     extra={"fields": {"model": model_name, "quantize": quantize}})
+            ORTModelForSequenceClassification.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+            if quantize:
+                _quantize(export_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.model = ORTModelForSequenceClassification.from_pretrained(
+            export_dir, file_name=file_name, provider="CPUExecutionProvider", session_options=_session_options(num_threads),
+        )
+        self.num_labels = self.model.config.num_labels
+        self.max_length = max_length or self.tokenizer.model_max_length
+
+    def predict(self, sentences, batch_size=32, apply_softmax=False, **kwargs):
+        """Same output shapes and activations as CrossEncoder.predict."""
+        single_pair = isinstance(sentences[0], str)
+        pairs = [sentences] if single_pair else sentences
+
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            features = self.tokenizer(
+                [first for first, _ in batch], [second for _, second in batch],
+                padding=True, truncation="longest_first", max_length=self.max_length, return_tensors="np",
+            )
+            logits = np.asarray(self.model(**features).logits, dtype=np.float32)
+            if self.num_labels == 1:
+                logits = 1 / (1 + np.exp(-logits))  # CrossEncoder's default Sigmoid for regression heads
+            elif apply_softmax:
+                logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+                logits /= logits.sum(axis=1, keepdims=True)
+            scores.append(logits)
+
+        scores = np.concatenate(scores)
+        if self.num_labels == 1:
+            scores = scores[:, 0]
+        return scores[0] if single_pair else scores
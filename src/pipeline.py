@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from instrumentation import STAGE_SECONDS, span
+from scanner import DEFAULT_MAX_CONCURRENCY, iter_indexed_images
+from segregator import segregate_ocr_text
+from tokenizer import preprocess_answers
+from similarity_scoring import compute_similarity_and_marks_batch
+
+# Bounded hand-off between stages so a fast stage cannot run far ahead of a slow one
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_CPU_WORKERS = min(4, os.cpu_count() or 1)
+POLL_INTERVAL = 0.05  # seconds
+
+_DONE = object()
+
+
+class _StageError:
+    """Carries an exception from a stage thread to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def analyse_text(text):
+    """CPU stage: split OCR text into questions and lemmatize the answers."""
+    return preprocess_answers(segregate_ocr_text(text))
+
+
+def _timed_analyse(analyse_fn, text):
+    """Run analyse_fn and also return its wall time (measured where it runs, e.g. in a worker process)."""
+    start = time.perf_counter()
+    answers = analyse_fn(text)
+    return answers, time.perf_counter() - start
+
+
+def _put(q, item, stop):
+    """Put `item` on a bounded queue unless `stop` is set first; returns whether it was queued."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _ocr_stage(images, ocr_queue, ocr_concurrency, model, stop):
+    """I/O stage: OCR every sheet on a thread pool, feeding (index, image, text, ocr seconds) downstream."""
+    results = iter_indexed_images(images, max_concurrency=ocr_concurrency, ordered=False, model=model)
+    try:
+        for index, text, seconds in results:
+            if not _put(ocr_queue, (index, images[index], text, seconds), stop):
+                return
+        _put(ocr_queue, _DONE, stop)
+    except Exception as e:
+        _put(ocr_queue, _StageError(e), stop)
+    finally:
+        results.close()  # Cancels the sheets not yet sent to Gemini when the consumer stopped early
+
+
+def _nlp_stage(ocr_queue, nlp_queue, cpu_workers, analyse_fn, stop):
+    """CPU stage: run analyse_fn in a process pool (or inline when cpu_workers is 0)."""
+    executor = None
+    try:
+        if cpu_workers:
+            executor = ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+        pending = {}
+        upstream_done = False
+        while (not upstream_done or pending) and not stop.is_set():
+            if not upstream_done and len(pending) < max(1, 2 * cpu_workers):
+                try:
+                    item = ocr_queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    item = None
+                if item is _DONE:
+                    upstream_done = True
+                elif isinstance(item, _StageError):
+                    _put(nlp_queue, item, stop)
+                    return
+                elif item is not None:
+                    index, image, text, ocr_seconds = item
+                    if not text:
+                        _put(nlp_queue, (index, image, text, {}, {"ocr": ocr_seconds, "nlp": 0.0}), stop)
+                    elif executor is None:
+                        answers, nlp_seconds = _timed_analyse(analyse_fn, text)
+                        STAGE_SECONDS.observe(nlp_seconds, stage="nlp")
+                        _put(nlp_queue, (index, image, text, answers, {"ocr": ocr_seconds, "nlp": nlp_seconds}), stop)
+                    else:
+                        pending[executor.submit(_timed_analyse, analyse_fn, text)] = item
+
+            if pending:
+                done, _ = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, image, text, ocr_seconds = pending.pop(future)
+                    answers, nlp_seconds = future.result()
+                    STAGE_SECONDS.observe(nlp_seconds, stage="nlp")
+                    _put(nlp_queue, (index, image, text, answers, {"ocr": ocr_seconds, "nlp": nlp_seconds}), stop)
+        _put(nlp_queue, _DONE, stop)
+    except Exception as e:
+        _put(nlp_queue, _StageError(e), stop)
+    finally:
+        if executor is not None:
+            # Waits only for analyses already running, so no worker process outlives the pipeline
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _score_sheets(sheets, answer_key, score_fn, cascade=False, answer_index=None):
+    """Scoring stage: one batched model pass over every answered question of the ready sheets.
+
+    With an answer_index, repeated answers reuse earlier scores and
+    (near-)duplicates are recorded per question. The batch's wall time is
+    split across sheets by their share of the pairs.
+    """
+    index, pairs = [], []
+    for sheet in sheets:
+        sheet["marks"] = {} if answer_key else None
+        sheet["duplicates"] = {}
+        for q, ans in sheet["answers"].items():
+            if answer_key and q in answer_key:
+                index.append((sheet, q))
+                pairs.append((answer_key[q], ans))
+
+    with span("scoring") as scoring:
+        if answer_index is not None and pairs:
+            # Paths stay meaningful across grade_sheets calls sharing one index; in-memory images use their position
+            labels = [sheet["image"] if isinstance(sheet["image"], str) else sheet["index"] for sheet, _ in index]
+            items = [(q, key_answer, ans, label) for (_, q), (key_answer, ans), label in zip(index, pairs, labels)]
+            results, duplicates, _ = answer_index.score(items, score_fn, cascade=cascade)
+            for (sheet, q), matches in zip(index, duplicates):
+                if matches:
+                    sheet["duplicates"][q] = matches
+        else:
+            results = score_fn(pairs, cascade=cascade) if pairs else []
+    for (sheet, q), result in zip(index, results):
+        sheet["marks"][q] = result
+    for sheet in sheets:
+        sheet["timings"]["scoring"] = scoring.seconds * len(sheet["marks"] or {}) / len(pairs) if pairs else 0.0
+    return sheets
+
+
+def grade_sheets(images, answer_key=None, ocr_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 cpu_workers=DEFAULT_CPU_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, model=None, cascade=False,
+                 analyse_fn=analyse_text, score_fn=compute_similarity_and_marks_batch, answer_index=None):
+    """Stream graded sheets as soon as each one clears OCR, NLP and scoring.
+
+    `images` are file paths, bytes or binary file-like objects (see scanner);
+    a PDF or multi-page TIFF booklet is graded as one sheet.
+
+    Stages run concurrently and are connected by bounded queues, so total time
+    tends towards that of the slowest stage rather than the sum of all stages.
+    Yields one dict per sheet (in completion order) with keys "index", "image",
+    "text", "answers" (lemmatized, per question), "marks" (per-question
+    scoring dicts, or None without an answer key) and "timings" (seconds
+    spent on the sheet's "ocr", "nlp" and "scoring"). cascade=True scores in
+    similarity_scoring's cascade mode. analyse_fn / score_fn replace the
+    in-process NLP and scoring stages, e.g. with inference_client's.
+
+    An answer_index.AnswerIndex reuses the scores of repeated answers across
+    batches; each sheet's "duplicates" then maps questions to the
+    [(image path or index, similarity)] of earlier answers it (nearly) duplicates.
+
+    Closing the generator early (break, an exception, a Streamlit rerun) stops
+    both stages: sheets not yet sent to OCR are cancelled and the NLP worker
+    processes are shut down.
+    """
+    images = list(images)
+    ocr_queue = queue.Queue(maxsize=queue_size)
+    nlp_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    threading.Thread(target=_ocr_stage, args=(images, ocr_queue, ocr_concurrency, model, stop), daemon=True).start()
+    nlp_thread = threading.Thread(target=_nlp_stage, args=(ocr_queue, nlp_queue, cpu_workers, analyse_fn, stop), daemon=True)
+    nlp_thread.start()
+
+    try:
+        upstream_done = False
+        while not upstream_done:
+            # Micro-batch: wait for one sheet, then take whatever else is already ready
+            ready = [nlp_queue.get()]
+            while True:
+                try:
+                    ready.append(nlp_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            sheets = []
+            for item in ready:
+                if item is _DONE:
+                    upstream_done = True
+                elif isinstance(item, _StageError):
+                    raise item.error
+                else:
+                    index, image, text, answers, timings = item
+                    sheets.append({"index": index, "image": image, "text": text, "answers": answers, "timings": timings})
+
+            yield from _score_sheets(sheets, answer_key, score_fn, cascade, answer_index)
+    finally:
+        stop.set()
+        _drain(ocr_queue)
+        _drain(nlp_queue)
+        # The OCR thread winds down once its in-flight Gemini calls return; the NLP one is quick to stop
+        nlp_thread.join()
@@ -0,0 +1,220 @@
+"""Incremental regrading of a stored exam run.
+
+Every item graded by main.py records the inputs it depends on: image hash,
+OCR text hash, key-answer hash, model versions and scoring parameters. A
+regrade compares those with the current answer key, images, models and
+parameters, and recomputes only what changed:
+
+  * changed image          -> OCR, segregation, lemmatization and scoring of that sheet
+  * changed key answer     -> the scoring models for the affected pairs (no OCR)
+  * changed model versions -> the scoring models for the affected pairs (no OCR)
+  * changed parameters     -> marks from the stored raw scores, in one vectorized pass (no models)
+
+Everything is written as a new run containing every item, so the latest run
+of an exam is always complete. Parameters set with --weights / --threshold
+stay in effect: later regrades, main.py and batch_grade.py grade the exam
+with the parameters stored with its latest run (see use_stored_scoring_params).
+
+Usage (from the repository root):
+    python src/regrade.py --exam-id midterm [--answer-key answer_key.json] [--images answers]
+                          [--weights 0.3 0.5 0.2] [--threshold 0.6] [--cascade]
+"""
+import argparse
+import json
+import os
+import numpy as np
+import similarity_scoring
+from results_store import (
+    RESULTS_DIR, SCORE_STAGES, ResultsWriter, content_hash, file_hash, latest_run_id, new_run_id, read_items, read_results,
+)
+
+
+# Most expensive action wins when several inputs of an item changed
+ACTIONS = ("keep", "marks", "models", "ocr", "drop")
+
+
+def item_provenance(image_hash, ocr_text_hash, key_answer, answer):
+    """Input columns recorded with a graded item (see results_store.ITEM_SCHEMA)."""
+    return {
+        "image_hash": image_hash,
+        "ocr_text_hash": ocr_text_hash,
+        "key_hash": content_hash(key_answer),
+        "key_answer": key_answer,
+        "answer": answer,
+        "model_versions": json.dumps(similarity_scoring.model_versions(), sort_keys=True),
+        "scoring_params": json.dumps(similarity_scoring.scoring_params(), sort_keys=True),
+    }
+
+
+def stored_scoring_params(exam_id, results_dir=RESULTS_DIR):
+    """Scoring parameters recorded with the latest run of `exam_id`, or None if it has none."""
+    run_id = latest_run_id(exam_id, results_dir)
+    if run_id is None:
+        return None
+    items = read_items(exam_id=exam_id, run_id=run_id, columns=["scoring_params", "graded_at"], results_dir=results_dir)
+    if items.empty:
+        return None
+    return json.loads(items.loc[items["graded_at"].idxmax(), "scoring_params"])
+
+
+def use_stored_scoring_params(exam_id, results_dir=RESULTS_DIR):
+    """Grade `exam_id` with the parameters of its latest run, so a regrade's weights are not silently reverted.
+
+    Returns the parameters put into effect, or None (module defaults kept) for a new exam.
+    """
+    params = stored_scoring_params(exam_id, results_dir)
+    if params is not None:
+        similarity_scoring.set_scoring_params(params)
+    return params
+
+
+def plan_regrade(items, answer_key=None, image_hashes=None):
+    """Action per stored item: "keep", "marks", "models", "ocr" or "drop" (question left the key).
+
+    `items` is a read_items() frame, `answer_key` the new preprocessed key
+    (None keeps the stored key answers) and `image_hashes` maps sheet file
+    names to their current hash (None skips the image check).
+    """
+    actions = np.full(len(items), "keep", dtype=object)
+    actions[(items["scoring_params"] != json.dumps(similarity_scoring.scoring_params(), sort_keys=True)).to_numpy()] = "marks"
+
+    models_changed = items["model_versions"] != json.dumps(similarity_scoring.model_versions(), sort_keys=True)
+    if answer_key is not None:
+        key_hashes = items["question"].map({str(q): content_hash(key) for q, key in answer_key.items()})
+        models_changed |= key_hashes.notna() & (key_hashes != items["key_hash"])
+    actions[models_changed.to_numpy()] = "models"
+
+    if image_hashes is not None:
+        current = items["sheet"].map(image_hashes)
+        actions[(current.notna() & (current != items["image_hash"])).to_numpy()] = "ocr"
+
+    if answer_key is not None:
+        actions[(~items["question"].isin([str(q) for q in answer_key])).to_numpy()] = "drop"
+    return actions
+
+
+def _stored_result(row):
+    """Rebuild a scoring dict from a row of stored stage scores (missing stages become None)."""
+    return {key: (None if np.isnan(row[stage]) else row[stage]) for key, stage in SCORE_STAGES.items()}
+
+
+def _regrade_sheets(image_paths, answer_key, cascade, writer, exam_id, run_id, student_ids):
+    """Full pipeline for new or changed sheets; returns the number of items written.
+
+    `student_ids` maps sheet file names to the student they were stored under
+    (e.g. from a batch_grade manifest); new sheets fall back to the file stem.
+    """
+    from pipeline import grade_sheets
+
+    written = 0
+    for sheet in grade_sheets(image_paths, answer_key, cascade=cascade):
+        sheet_name = os.path.basename(sheet["image"])
+        image_hash, text_hash = file_hash(sheet["image"]), content_hash(sheet["text"] or "")
+        for q, result in (sheet["marks"] or {}).items():
+            provenance = item_provenance(image_hash, text_hash, answer_key[q], sheet["answers"][q])
+            student_id = student_ids.get(sheet_name, os.path.splitext(sheet_name)[0])
+            writer.add_result(exam_id, run_id, student_id, sheet_name, q, result, provenance)
+            written += 1
+    return written
+
+
+def regrade(exam_id, answer_key=None, image_paths=None, cascade=False, results_dir=RESULTS_DIR):
+    """Regrade the latest run of `exam_id` as a new run; returns (run_id, counts per action).
+
+    `answer_key` is the new preprocessed key (None keeps the stored one) and
+    `image_paths` the current sheet images (None trusts the stored OCR).
+    """
+    previous_run = latest_run_id(exam_id, results_dir)
+    if previous_run is None:
+        raise ValueError(f"No stored run for exam '{exam_id}'.")
+    items = read_items(exam_id=exam_id, run_id=previous_run, results_dir=results_dir)
+    if items.empty:
+        raise ValueError(f"Run {previous_run} of exam '{exam_id}' has no item provenance; grade it again with main.py.")
+
+    scores = read_results(exam_id=exam_id, run_id=previous_run, columns=["student_id", "sheet", "question", "stage", "score"],
+                          results_dir=results_dir)
+    matrix = scores.pivot_table(index=["student_id", "sheet", "question"], columns="stage", values="score", aggfunc="last")
+    items = items.join(matrix.reindex(columns=list(SCORE_STAGES.values())), on=["student_id", "sheet", "question"])
+
+    if answer_key is None:
+        answer_key = dict(zip(items["question"], items["key_answer"]))
+        plan_key = None
+    else:
+        answer_key = {str(q): key for q, key in answer_key.items()}
+        plan_key = answer_key
+    image_hashes = {os.path.basename(path): file_hash(path) for path in image_paths} if image_paths is not None else None
+    items["action"] = plan_regrade(items, plan_key, image_hashes)
+
+    run_id = new_run_id()
+    with ResultsWriter(results_dir) as writer:
+        def write(row, result, key_answer):
+            provenance = item_provenance(row.image_hash, row.ocr_text_hash, key_answer, row.answer)
+            writer.add_result(exam_id, run_id, row.student_id, row.sheet, row.question, result, provenance)
+
+        # Unchanged items are carried over as they are
+        for row in items[items["action"] == "keep"].itertuples(index=False):
+            write(row, _stored_result(row._asdict()), row.key_answer)
+
+        # Parameter-only changes: one vectorized pass over the stored raw scores
+        marks_items = items[items["action"] == "marks"]
+        if not marks_items.empty:
+            average_scores, marks_percentages = similarity_scoring.marks_from_raw_scores(
+                marks_items["bi_encoder"], marks_items["cross_encoder"], marks_items["nli"],
+                marks_items["key_answer"].str.split().str.len(), marks_items["answer"].str.split().str.len(),
+            )
+            for k, row in enumerate(marks_items.itertuples(index=False)):
+                result = {**_stored_result(row._asdict()), "Weighted Average Score": average_scores[k], "Marks Percentage": marks_percentages[k]}
+                write(row, result, row.key_answer)
+
+        # New key answers or models: rescore the stored answer texts, skipping OCR
+        model_items = items[items["action"] == "models"]
+        if not model_items.empty:
+            pairs = [(answer_key[q], answer) for q, answer in zip(model_items["question"], model_items["answer"])]
+            results = similarity_scoring.compute_similarity_and_marks_batch(pairs, cascade=cascade)
+            for row, result in zip(model_items.itertuples(index=False), results):
+                write(row, result, answer_key[row.question])
+
+        # New or changed images go through the whole pipeline again
+        changed_sheets = set(items.loc[items["action"] == "ocr", "sheet"])
+        if image_hashes is not None:
+            changed_sheets |= set(image_hashes) - set(items["sheet"])
+        if changed_sheets:
+            paths = [path for path in image_paths if os.path.basename(path) in changed_sheets]
+            student_ids = dict(zip(items["sheet"], items["student_id"]))
+            _regrade_sheets(paths, answer_key, cascade, writer, exam_id, run_id, student_ids)
+
+    counts = {action: int((items["action"] == action).sum()) for action in ACTIONS}
+    counts["ocr_sheets"] = len(changed_sheets)
+    return run_id, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exam-id", default=os.getenv("EXAM_ID", "default"))
+    parser.add_argument("--answer-key", help="Edited answer key JSON; defaults to the key stored with the last run")
+    parser.add_argument("--images", help="Folder of answer sheets to check for new or changed images")
+    parser.add_argument("--weights", type=float, nargs=3, metavar=("BI", "CROSS", "NLI"))
+    parser.add_argument("--threshold", type=float)
+    parser.add_argument("--cascade", action="store_true", help="Rescore changed pairs in cascade mode")
+    args = parser.parse_args()
+
+    # Start from the parameters the exam was last graded with; flags override them
+    use_stored_scoring_params(args.exam_id)
+    if args.weights:
+        similarity_scoring.set_scoring_params(dict(zip(("bi_encoder_weight", "cross_encoder_weight", "nli_weight"), args.weights)))
+    if args.threshold is not None:
+        similarity_scoring.set_scoring_params({"marks_threshold": args.threshold})
+
+    from main import find_images, load_answer_key
+
+    answer_key = load_answer_key(args.answer_key) if args.answer_key else None
+    image_paths = find_images(args.images) if args.images else None
+
+    run_id, counts = regrade(args.exam_id, answer_key, image_paths, cascade=args.cascade)
+    print(f"✅ Regraded exam '{args.exam_id}' as run {run_id}")
+    print(f"   kept {counts['keep']}, marks only {counts['marks']}, rescored {counts['models']}, "
+          f"re-OCRed sheets {counts['ocr_sheets']}, dropped {counts['drop']}")
+
+
+if __name__ == "__main__":
+    main()
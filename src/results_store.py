@@ -0,0 +1,260 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Root of the Parquet dataset (hive-partitioned by exam_id)
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+DEFAULT_FLUSH_ROWS = 5000
+
+# One row per (exam, run, student, sheet, question, stage)
+SCHEMA = pa.schema([
+    ("exam_id", pa.string()),
+    ("run_id", pa.string()),
+    ("student_id", pa.string()),
+    ("sheet", pa.string()),
+    ("question", pa.string()),
+    ("stage", pa.string()),
+    ("score", pa.float64()),
+    ("detail", pa.string()),  # Optional free text, e.g. Gemini's explanation
+    ("graded_at", pa.timestamp("ms")),
+])
+
+# Inputs each graded item depends on, one row per (exam, run, student, sheet, question).
+# Kept under a "_"-prefixed directory so the scores dataset above does not pick it up.
+ITEMS_DIR_NAME = "_items"
+ITEM_SCHEMA = pa.schema([
+    ("exam_id", pa.string()),
+    ("run_id", pa.string()),
+    ("student_id", pa.string()),
+    ("sheet", pa.string()),
+    ("question", pa.string()),
+    ("image_hash", pa.string()),
+    ("ocr_text_hash", pa.string()),
+    ("key_hash", pa.string()),
+    ("key_answer", pa.string()),  # Preprocessed texts, so models can be rerun without OCR
+    ("answer", pa.string()),
+    ("model_versions", pa.string()),  # JSON, see similarity_scoring.model_versions()
+    ("scoring_params", pa.string()),  # JSON, see similarity_scoring.scoring_params()
+    ("graded_at", pa.timestamp("ms")),
+])
+
+# Columns identifying one stored score / item; see _read_latest()
+RESULT_KEY = ["exam_id", "run_id", "student_id", "sheet", "question", "stage"]
+ITEM_KEY = ["exam_id", "run_id", "student_id", "sheet", "question"]
+
+# Scoring-dict keys from similarity_scoring mapped to stage names
+SCORE_STAGES = {
+    "Bi-Encoder Score": "bi_encoder",
+    "Cross-Encoder Score": "cross_encoder",
+    "Adjusted Opposite Score": "nli",
+    "Weighted Average Score": "weighted",
+    "Marks Percentage": "marks",
+}
+
+
+def new_run_id():
+    """Identifier grouping the rows written by one grading run."""
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def content_hash(data):
+    """Stable hex digest of bytes or text, used to detect changed inputs."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return content_hash(f.read())
+
+
+def score_rows(exam_id, run_id, student_id, sheet, question, result):
+    """Flatten one similarity_scoring result dict into stage rows (skipped stages are left out)."""
+    return [
+        {
+            "exam_id": exam_id, "run_id": run_id, "student_id": student_id, "sheet": sheet,
+            "question": str(question), "stage": stage, "score": float(result[key]), "detail": None,
+        }
+        for key, stage in SCORE_STAGES.items()
+        if result.get(key) is not None
+    ]
+
+
+def item_row(exam_id, run_id, student_id, sheet, question, provenance):
+    """One items-table row; `provenance` holds the ITEM_SCHEMA input columns."""
+    return {"exam_id": exam_id, "run_id": run_id, "student_id": student_id, "sheet": sheet,
+            "question": str(question), **provenance}
+
+
+def _append(rows, root_path, schema):
+    if not rows:
+        return
+    table = pa.Table.from_pylist(
+        [{**row, "graded_at": row.get("graded_at") or pd.Timestamp.now()} for row in rows],
+        schema=schema,
+    )
+    pq.write_to_dataset(
+        table, root_path=root_path, partition_cols=["exam_id"],
+        basename_template=f"part-{new_run_id()}-{{i}}.parquet",
+    )
+
+
+def append_rows(rows, results_dir=RESULTS_DIR):
+    """Append a batch of row dicts as new Parquet files; existing files are never rewritten."""
+    _append(rows, results_dir, SCHEMA)
+
+
+def append_items(rows, results_dir=RESULTS_DIR):
+    """Append item provenance rows (see ITEM_SCHEMA)."""
+    _append(rows, os.path.join(results_dir, ITEMS_DIR_NAME), ITEM_SCHEMA)
+
+
+class ResultsWriter:
+    """Buffers rows in memory and appends them in Arrow batches of `flush_rows`."""
+
+    def __init__(self, results_dir=RESULTS_DIR, flush_rows=DEFAULT_FLUSH_ROWS):
+        self.results_dir = results_dir
+        self.flush_rows = flush_rows
+        self._rows = []
+        self._items = []
+        self._lock = threading.Lock()
+
+    def add(self, rows, items=()):
+        with self._lock:
+            self._rows.extend(rows)
+            self._items.extend(items)
+            if len(self._rows) + len(self._items) < self.flush_rows:
+                return
+        self.flush()
+
+    def add_result(self, exam_id, run_id, student_id, sheet, question, result, provenance=None):
+        """Buffer the stage rows of one scoring dict, plus its item row when `provenance` is given."""
+        items = [item_row(exam_id, run_id, student_id, sheet, question, provenance)] if provenance else []
+        self.add(score_rows(exam_id, run_id, student_id, sheet, question, result), items)
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            items, self._items = self._items, []
+        append_rows(rows, self.results_dir)
+        append_items(items, self.results_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def _dataset(results_dir):
+    return ds.dataset(results_dir, format="parquet", partitioning="hive", schema=SCHEMA)
+
+
+def _filter_expression(**filters):
+    """AND of equality / membership conditions, skipping filters that are None."""
+    expression = None
+    for column, value in filters.items():
+        if value is None:
+            continue
+        condition = ds.field(column).isin(value) if isinstance(value, (list, tuple, set)) else ds.field(column) == value
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _read_latest(dataset, key, columns, expression):
+    """Filtered read keeping only the newest row per `key`, in stored order.
+
+    A resumed batch run regrades sheets whose results were flushed but not yet
+    journaled, so the same item can be stored twice under one run.
+    """
+    read_columns = None if columns is None else list(dict.fromkeys([*columns, *key, "graded_at"]))
+    frame = dataset.to_table(columns=read_columns, filter=expression).to_pandas()
+    frame = frame.sort_values("graded_at", kind="stable").drop_duplicates(key, keep="last").sort_index()
+    return frame.reset_index(drop=True) if columns is None else frame[columns].reset_index(drop=True)
+
+
+def read_results(exam_id=None, run_id=None, student_id=None, question=None, stage=None,
+                 columns=None, results_dir=RESULTS_DIR):
+    """Filtered read as a DataFrame; filters are pushed down to Parquet (partition pruning on exam_id).
+
+    Each filter accepts a single value or a list of values. A score stored
+    more than once for the same item and stage of a run is read once (the newest).
+    """
+    if not os.path.isdir(results_dir):
+        return pd.DataFrame(columns=columns or SCHEMA.names)
+
+    expression = _filter_expression(exam_id=exam_id, run_id=run_id, student_id=student_id, question=question, stage=stage)
+    return _read_latest(_dataset(results_dir), RESULT_KEY, columns, expression)
+
+
+def read_items(exam_id=None, run_id=None, student_id=None, question=None, columns=None, results_dir=RESULTS_DIR):
+    """Filtered read of item provenance rows as a DataFrame, newest row per item of a run."""
+    items_dir = os.path.join(results_dir, ITEMS_DIR_NAME)
+    if not os.path.isdir(items_dir):
+        return pd.DataFrame(columns=columns or ITEM_SCHEMA.names)
+
+    expression = _filter_expression(exam_id=exam_id, run_id=run_id, student_id=student_id, question=question)
+    dataset = ds.dataset(items_dir, format="parquet", partitioning="hive", schema=ITEM_SCHEMA)
+    return _read_latest(dataset, ITEM_KEY, columns, expression)
+
+
+def latest_run_id(exam_id, results_dir=RESULTS_DIR):
+    """Most recent run of an exam, or None."""
+    runs = read_results(exam_id=exam_id, columns=["run_id", "graded_at"], results_dir=results_dir)
+    if runs.empty:
+        return None
+    return runs.loc[runs["graded_at"].idxmax(), "run_id"]
+
+
+def _run_or_latest(exam_id, run_id, results_dir):
+    # Each run (including a regrade) holds every item, so mixing runs would count items more than once
+    return run_id if run_id is not None else latest_run_id(exam_id, results_dir)
+
+
+def question_summary(exam_id, run_id=None, stage="marks", results_dir=RESULTS_DIR):
+    """Class-level statistics per question for one stage, from `run_id` or else the exam's latest run."""
+    run_id = _run_or_latest(exam_id, run_id, results_dir)
+    frame = read_results(exam_id=exam_id, run_id=run_id, stage=stage, columns=["question", "score"], results_dir=results_dir)
+    return frame.groupby("question")["score"].agg(["count", "mean", "median", "min", "max", "std"]).reset_index()
+
+
+def student_totals(exam_id, run_id=None, stage="marks", results_dir=RESULTS_DIR):
+    """Per-student total and mean of one stage across questions, from `run_id` or else the latest run."""
+    run_id = _run_or_latest(exam_id, run_id, results_dir)
+    frame = read_results(exam_id=exam_id, run_id=run_id, stage=stage, columns=["student_id", "score"], results_dir=results_dir)
+    return frame.groupby("student_id")["score"].agg(total="sum", mean="mean", questions="count").reset_index()
+
+
+def stage_matrix(exam_id, run_id=None, student_id=None, stages=None, results_dir=RESULTS_DIR):
+    """Wide view: one row per (student, question), one column per stage, from `run_id` or else the latest run."""
+    run_id = _run_or_latest(exam_id, run_id, results_dir)
+    frame = read_results(exam_id=exam_id, run_id=run_id, student_id=student_id, stage=stages,
+                         columns=["student_id", "question", "stage", "score"], results_dir=results_dir)
+    return frame.pivot_table(index=["student_id", "question"], columns="stage", values="score", aggfunc="last").reset_index()
+
+
+def _compact_partition(root_path, schema, exam_id):
+    partition = os.path.join(root_path, f"exam_id={exam_id}")
+    if not os.path.isdir(partition):
+        return
+    old_files = [os.path.join(partition, name) for name in os.listdir(partition) if name.endswith(".parquet")]
+    if len(old_files) < 2:
+        return
+    dataset = ds.dataset(root_path, format="parquet", partitioning="hive", schema=schema)
+    table = dataset.to_table(filter=ds.field("exam_id") == exam_id).drop(["exam_id"])
+    pq.write_table(table, os.path.join(partition, f"part-{new_run_id()}-compacted.parquet"))
+    for path in old_files:
+        os.remove(path)
+
+
+def compact(exam_id, results_dir=RESULTS_DIR):
+    """Merge an exam's many small appended files into one (run offline; not safe alongside writers)."""
+    _compact_partition(results_dir, SCHEMA, exam_id)
+    _compact_partition(os.path.join(results_dir, ITEMS_DIR_NAME), ITEM_SCHEMA, exam_id)
@@ -0,0 +1,48 @@
+import asyncio
+import random
+import time
+from instrumentation import RETRIES, get_logger
+
+log = get_logger("retry")
+
+# Retry policy shared by the Gemini OCR and grading calls
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 30.0  # seconds
+
+
+def is_rate_limit_error(error):
+    """Whether an API error means we were throttled (HTTP 429 / quota exhausted)."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(error, "code", None) == 429 or "429" in str(error)
+
+
+def is_retryable_error(error):
+    """Rate limits and timeouts are worth retrying; anything else is not."""
+    timed_out = isinstance(error, (TimeoutError, asyncio.TimeoutError)) or type(error).__name__ == "DeadlineExceeded"
+    return timed_out or is_rate_limit_error(error)
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def call_with_retries(fn, max_retries=MAX_RETRIES, label="request", retryable=is_retryable_error, operation="request"):
+    """Call fn(), retrying retryable errors with backoff; the last error propagates.
+
+    `label` identifies the item in log lines, `operation` the kind of call in metrics.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt < max_retries and retryable(e):
+                delay = backoff_delay(attempt)
+                RETRIES.inc(operation=operation)
+                log.warning(f"⏳ {label}: {e} - retrying in {delay:.1f}s",
+                            extra={"fields": {"operation": operation, "item": label, "attempt": attempt + 1, "delay": delay}})
+                time.sleep(delay)
+                continue
+            raise
@@ -1,7 +1,18 @@
-import google.generativeai as genai
+import asyncio
+import io
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import Image, ImageOps
+from documents import document_kind, iter_pages
+from instrumentation import API_CALLS, CACHE_LOOKUPS, RETRIES, get_logger, span
+from ocr_cache import cache_key, get_cache
+from retry import MAX_RETRIES, backoff_delay, call_with_retries, is_retryable_error
+
+log = get_logger("scanner")
 
 # Load environment variables
 load_dotenv()
@@ -9,33 +20,382 @@ load_dotenv()
 API_KEY = os.getenv("API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME")
 
-# Check API key and model name
-if not API_KEY:
-    raise ValueError("❌ API_KEY not found in environment variables. Please check your .env file.")
-if not MODEL_NAME:
-    raise ValueError("❌ MODEL_NAME not found in environment variables. Please check your .env file.")
+OCR_PROMPT = "Extract the text in the image verbatim and correct any spelling mistakes if needed."
+# Appended when several pages of a PDF/TIFF booklet go out in one request
+MULTI_PAGE_PROMPT = "The images are consecutive pages of one answer booklet; transcribe them in page order as one continuous text."
+PAGES_PER_REQUEST = int(os.getenv("PAGES_PER_REQUEST", "4"))  # Fewer round-trips per booklet vs. smaller requests
+
+# Concurrency policy for batch OCR (retries follow retry.py)
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 120  # seconds per request
+
+# Skip the Gemini call for images we have already read with the same model and prompt
+OCR_CACHE_ENABLED = True
+
+# Client-side preprocessing applied before an image is uploaded for OCR
+PREPROCESSING = {
+    "enabled": True,
+    "exif_transpose": True,   # Apply the camera's EXIF orientation
+    "grayscale": True,
+    "max_long_edge": 2048,    # Pixels; None keeps the original resolution
+    "autocontrast": True,     # Stretch the histogram, ignoring 1% outliers
+    "deskew": False,          # Estimate and undo small page rotations
+    "max_skew_angle": 5.0,    # Degrees searched either side of upright
+    "format": "JPEG",         # JPEG or WEBP
+    "quality": 80,
+}
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Return the shared Gemini model, configuring the API on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            # Check API key and model name
+            if not API_KEY:
+                raise ValueError("❌ API_KEY not found in environment variables. Please check your .env file.")
+            if not MODEL_NAME:
+                raise ValueError("❌ MODEL_NAME not found in environment variables. Please check your .env file.")
+
+            import google.generativeai as genai
+
+            # Configure the API
+            genai.configure(api_key=API_KEY)
+            _model = genai.GenerativeModel(model_name=MODEL_NAME)
+        return _model
+
+
+def _model_name(model):
+    return getattr(model, "model_name", None) or MODEL_NAME
+
+
+def _read_image_bytes(image):
+    """Bytes of an image given as a file path, bytes or a binary file-like object (e.g. an upload)."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, "read"):
+        if hasattr(image, "seek"):
+            image.seek(0)
+        return image.read()
+    with open(image, "rb") as f:
+        return f.read()
+
+
+def _image_label(image):
+    """Short name of an image for log lines."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return f"<{len(image) / 1024:.0f} KB image>"
+    name = getattr(image, "name", image)
+    return os.path.basename(name) if isinstance(name, (str, os.PathLike)) else repr(image)
+
+
+def _estimate_skew(image, max_angle):
+    """Angle (degrees) that best aligns text lines, via horizontal projection profiles."""
+    small = image.convert("L")
+    small.thumbnail((800, 800))
+    ink = Image.eval(small, lambda px: 255 if px < 128 else 0)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + 0.01, 0.5):
+        rows = np.asarray(ink.rotate(float(angle), expand=False), dtype=np.float32).sum(axis=1)
+        score = float(np.var(rows))  # Aligned lines give sharp peaks between empty rows
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_image(image_bytes, config=None):
+    """Shrink an answer-sheet photo before OCR.
+
+    Returns (payload bytes, MIME type, report) where report holds the byte
+    counts and pixel sizes before/after and the time spent.
+    """
+    config = {**PREPROCESSING, **(config or {})}
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes))
+    original_size = image.size
+    original_mime = Image.MIME.get(image.format, "image/jpeg")
+
+    if not config["enabled"]:
+        payload, mime_type = image_bytes, original_mime
+    else:
+        if config["exif_transpose"]:
+            image = ImageOps.exif_transpose(image)
+        image = image.convert("L") if config["grayscale"] else image.convert("RGB")
+        if config["max_long_edge"] and max(image.size) > config["max_long_edge"]:
+            image.thumbnail((config["max_long_edge"], config["max_long_edge"]), Image.LANCZOS)
+        if config["autocontrast"]:
+            image = ImageOps.autocontrast(image, cutoff=1)
+        if config["deskew"]:
+            angle = _estimate_skew(image, config["max_skew_angle"])
+            if angle:
+                image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255 if image.mode == "L" else "white")
+
+        output = io.BytesIO()
+        image.save(output, format=config["format"], quality=config["quality"], optimize=True)
+        payload, mime_type = output.getvalue(), Image.MIME[config["format"].upper()]
+
+    report = {
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(payload),
+        "size_before": original_size,
+        "size_after": image.size,
+        "seconds": time.perf_counter() - start,
+    }
+    return payload, mime_type, report
+
+
+def _image_part(image, image_bytes):
+    """Preprocess an image into an inline-data part for generate_content."""
+    with span("image_preprocess"):
+        payload, mime_type, report = preprocess_image(image_bytes)
+    log.info(
+        f"🗜️ {_image_label(image)}: {report['bytes_before'] / 1024:.0f} KB → "
+        f"{report['bytes_after'] / 1024:.0f} KB in {report['seconds'] * 1000:.0f} ms",
+        extra={"fields": {"image": _image_label(image), **report}},
+    )
+    return {"mime_type": mime_type, "data": payload}
+
+
+def _cached_text(image_bytes, model, prompt):
+    """Look up a previous OCR result; returns (cache key, text or None)."""
+    if not OCR_CACHE_ENABLED:
+        return None, None
+    # Preprocessing changes what the model sees, so it is part of the cache key
+    key = cache_key(image_bytes, _model_name(model), prompt + repr(sorted(PREPROCESSING.items())))
+    text = get_cache().get(key)
+    CACHE_LOOKUPS.inc(cache="ocr", result="miss" if text is None else "hit")
+    return key, text
+
+
+def _store_text(key, text):
+    if key is not None and text:
+        get_cache().put(key, text)
+
+
+def ocr_cache_stats():
+    """Hit/miss counts of the OCR result cache."""
+    return get_cache().stats()
+
+
+def _request_text(model, parts, prompt, timeout=None):
+    """One generate_content call on image parts + prompt; returns the text (None if empty)."""
+    try:
+        with span("ocr_request"):
+            if timeout is None:
+                response = model.generate_content([*parts, prompt])
+            else:
+                response = model.generate_content([*parts, prompt], request_options={"timeout": timeout})
+    except Exception:
+        API_CALLS.inc(api="ocr", outcome="error")
+        raise
+    API_CALLS.inc(api="ocr", outcome="ok")
+    return response.text if response else None
+
+
+def _page_groups(document, pages_per_request):
+    """(first page number, [page bytes]) groups of a booklet; only one group is decoded at a time."""
+    group, first_page = [], 1
+    for page_number, page in enumerate(iter_pages(document), start=1):
+        group.append(page)
+        if len(group) == pages_per_request:
+            yield first_page, group
+            group, first_page = [], page_number + 1
+    if group:
+        yield first_page, group
 
-# Configure the API
-genai.configure(api_key=API_KEY)
 
-def extract_text_from_image(image_path, prompt):
+def _generate_document_text(model, document, prompt, timeout=None):
+    """OCR a PDF/TIFF booklet PAGES_PER_REQUEST pages per request and stitch the page texts in order."""
+    texts, pages, requests = [], 0, 0
+    for first_page, group in _page_groups(document, max(1, PAGES_PER_REQUEST)):
+        pages += len(group)
+        group_prompt = prompt if len(group) == 1 else f"{prompt} {MULTI_PAGE_PROMPT}"
+        key, text = _cached_text(b"".join(group), model, group_prompt)
+        if text is None:
+            parts = [_image_part(f"{_image_label(document)} p{first_page + i}", page) for i, page in enumerate(group)]
+            text = _request_text(model, parts, group_prompt, timeout)
+            _store_text(key, text)
+            requests += 1
+        if text:
+            texts.append(text.strip())
+    log.info(f"📚 {_image_label(document)}: {pages} pages in {requests} OCR requests",
+             extra={"fields": {"image": _image_label(document), "pages": pages, "requests": requests}})
+    # One continuous text, so question numbering and answers run on across page breaks before segregation
+    return "\n".join(texts) or None
+
+
+def _generate_text(model, image, prompt, timeout=None):
+    """Send one image (or every page of a booklet) to the model and return its text; errors propagate."""
+    if document_kind(image):
+        return _generate_document_text(model, image, prompt, timeout)
+
+    image_bytes = _read_image_bytes(image)
+    key, text = _cached_text(image_bytes, model, prompt)
+    if text is not None:
+        log.info(f"♻️ Using cached text for {_image_label(image)}")
+        return text
+
+    text = _request_text(model, [_image_part(image, image_bytes)], prompt, timeout)
+    _store_text(key, text)
+    return text
+
+
+def extract_text_from_image(image, prompt, model=None):
     """Extract text from the image."""
     try:
-        model = genai.GenerativeModel(model_name=MODEL_NAME)
-        print(f"🔍 Extracting text from {os.path.basename(image_path)}...")
+        model = model or get_model()
+        log.info(f"🔍 Extracting text from {_image_label(image)}...")
 
         # Load image and send to the model
-        image = Image.open(image_path)
-        response = model.generate_content([image, prompt])
-
-        return response.text if response else None
+        with span("ocr", key=_image_label(image)):
+            return _generate_text(model, image, prompt)
     except Exception as e:
-        print(f"❌ Error extracting text: {e}")
+        log.error(f"❌ Error extracting text: {e}", extra={"fields": {"image": _image_label(image)}})
         return None
 
-def process_image(image_path):
+
+def process_image(image, model=None):
     """Process a single image and return the extracted text."""
-    return extract_text_from_image(
-        image_path, 
-        "Extract the text in the image verbatim and correct any spelling mistakes if needed."
-    )
+    return extract_text_from_image(image, OCR_PROMPT, model=model)
+
+
+def _extract_with_retries(image, prompt, model, timeout, max_retries):
+    """Blocking OCR call retried on rate limits/timeouts; returns None on failure."""
+    def attempt():
+        log.info(f"🔍 Extracting text from {_image_label(image)}...")
+        return _generate_text(model, image, prompt, timeout)
+
+    try:
+        return call_with_retries(attempt, max_retries=max_retries, label=_image_label(image), operation="ocr")
+    except Exception as e:
+        log.error(f"❌ Error extracting text: {e}", extra={"fields": {"image": _image_label(image)}})
+        return None
+
+
+def _timed_extract(image, prompt, model, timeout, max_retries):
+    with span("ocr", key=_image_label(image)) as timer:
+        text = _extract_with_retries(image, prompt, model, timeout, max_retries)
+    return text, timer.seconds
+
+
+def iter_indexed_images(images, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                        ordered=True, prompt=OCR_PROMPT, model=None, max_retries=MAX_RETRIES):
+    """OCR many images on a bounded thread pool, yielding (input index, text, seconds).
+
+    Images may be file paths, bytes or binary file-like objects; a PDF or
+    multi-page TIFF booklet counts as one image whose page texts are stitched. With
+    ordered=True results come back in input order, each as soon as it and
+    everything before it is done; with ordered=False they stream as they complete.
+    """
+    images = list(images)
+    model = model or get_model()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    try:
+        futures = {
+            executor.submit(_timed_extract, image, prompt, model, timeout, max_retries): i
+            for i, image in enumerate(images)
+        }
+        for future in (futures if ordered else as_completed(futures)):
+            yield (futures[future], *future.result())
+    finally:
+        # Stop queued work if the consumer bails out early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_processed_images(images, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                          ordered=True, prompt=OCR_PROMPT, model=None, max_retries=MAX_RETRIES):
+    """OCR many images on a bounded thread pool, yielding (image, text) pairs (see iter_indexed_images)."""
+    images = list(images)
+    for index, text, _ in iter_indexed_images(images, max_concurrency, timeout, ordered, prompt, model, max_retries):
+        yield images[index], text
+
+
+def process_images(images, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                   prompt=OCR_PROMPT, model=None, max_retries=MAX_RETRIES):
+    """OCR many images concurrently and return their texts in input order."""
+    return [
+        text for _, text in iter_processed_images(
+            images, max_concurrency=max_concurrency, timeout=timeout, ordered=True,
+            prompt=prompt, model=model, max_retries=max_retries,
+        )
+    ]
+
+
+async def _extract_async(image, prompt, model, timeout, max_retries):
+    """Async OCR call with a hard per-request timeout, retried on rate limits/timeouts."""
+    with span("ocr", key=_image_label(image)):
+        for attempt in range(max_retries + 1):
+            try:
+                log.info(f"🔍 Extracting text from {_image_label(image)}...")
+                if await asyncio.to_thread(document_kind, image):
+                    return await asyncio.to_thread(_generate_document_text, model, image, prompt, timeout)
+                image_bytes = await asyncio.to_thread(_read_image_bytes, image)
+                key, text = await asyncio.to_thread(_cached_text, image_bytes, model, prompt)
+                if text is not None:
+                    log.info(f"♻️ Using cached text for {_image_label(image)}")
+                    return text
+
+                part = await asyncio.to_thread(_image_part, image, image_bytes)
+                if hasattr(model, "generate_content_async"):
+                    request = model.generate_content_async([part, prompt])
+                else:
+                    request = asyncio.to_thread(model.generate_content, [part, prompt])
+                try:
+                    with span("ocr_request"):
+                        response = await asyncio.wait_for(request, timeout)
+                except Exception:
+                    API_CALLS.inc(api="ocr", outcome="error")
+                    raise
+                API_CALLS.inc(api="ocr", outcome="ok")
+                text = response.text if response else None
+                await asyncio.to_thread(_store_text, key, text)
+                return text
+            except Exception as e:
+                if attempt < max_retries and is_retryable_error(e):
+                    delay = backoff_delay(attempt)
+                    RETRIES.inc(operation="ocr")
+                    log.warning(f"⏳ {_image_label(image)}: {e!r} - retrying in {delay:.1f}s",
+                                extra={"fields": {"operation": "ocr", "item": _image_label(image), "attempt": attempt + 1}})
+                    await asyncio.sleep(delay)
+                    continue
+                log.error(f"❌ Error extracting text: {e!r}", extra={"fields": {"image": _image_label(image)}})
+                return None
+
+
+async def _aiter_indexed(images, max_concurrency, timeout, prompt, model, max_retries):
+    """Run async OCR under a semaphore, yielding (input index, text) as requests complete."""
+    model = model or get_model()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(index, image):
+        async with semaphore:
+            return index, await _extract_async(image, prompt, model, timeout, max_retries)
+
+    tasks = [asyncio.ensure_future(run(i, image)) for i, image in enumerate(images)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def aiter_processed_images(images, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                                 prompt=OCR_PROMPT, model=None, max_retries=MAX_RETRIES):
+    """Async generator yielding (image, text) pairs as each OCR request completes."""
+    images = list(images)
+    async for index, text in _aiter_indexed(images, max_concurrency, timeout, prompt, model, max_retries):
+        yield images[index], text
+
+
+async def process_images_async(images, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                               prompt=OCR_PROMPT, model=None, max_retries=MAX_RETRIES):
+    """Async variant of process_images; returns texts in input order."""
+    images = list(images)
+    texts = [None] * len(images)
+    async for index, text in _aiter_indexed(images, max_concurrency, timeout, prompt, model, max_retries):
+        texts[index] = text
+    return texts
@@ -1,11 +1,187 @@
+import os
 import numpy as np
 from scipy.spatial.distance import cosine
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from instrumentation import span
+from model_registry import DEFAULT_PROFILE, get_model, model_profile, register_model
+from embedding_cache import get_store
 
-# Load models
-bi_encoder_model = SentenceTransformer('sentence-transformers/nli-roberta-base-v2')
-cross_encoder_stsb = CrossEncoder('cross-encoder/stsb-roberta-base')
-cross_encoder_nli = CrossEncoder('cross-encoder/nli-distilroberta-base')
+# Scoring weights and marks curve
+BI_ENCODER_WEIGHT = 0.3
+CROSS_ENCODER_WEIGHT = 0.5
+NLI_WEIGHT = 0.2
+MARKS_THRESHOLD = 0.6
+LENGTH_PENALTY_RATIO = 0.8
+LENGTH_PENALTY_FACTOR = 0.85
+
+# Default number of texts / pairs sent through a model per forward pass
+DEFAULT_BATCH_SIZE = 32
+
+# Cascade mode: bi-encoder scores at or outside these bands skip the cross-encoders
+CASCADE_LOW_BAND = 0.45
+CASCADE_HIGH_BAND = 0.97
+_cascade_counts = {"pairs": 0, "bi_encoder": 0, "cross_encoders": 0}
+
+# Long-answer mode: texts beyond the models' input limits are split into overlapping token
+# windows, and each key window is scored against its LONG_ANSWER_CANDIDATES closest student
+# windows (by bi-encoder similarity) instead of being truncated
+LONG_ANSWER_MODE = os.getenv("LONG_ANSWER_MODE", "0") == "1"
+LONG_ANSWER_WINDOW_TOKENS = int(os.getenv("LONG_ANSWER_WINDOW_TOKENS", "0"))  # 0 = largest window both models read whole
+LONG_ANSWER_OVERLAP = 0.25  # Fraction of a window repeated at the start of the next one
+LONG_ANSWER_CANDIDATES = 2
+_long_answer_counts = {"pairs": 0, "window_pairs": 0, "all_window_pairs": 0}
+
+# Model names
+BI_ENCODER_MODEL_NAME = 'sentence-transformers/nli-roberta-base-v2'
+CROSS_ENCODER_STSB_MODEL_NAME = 'cross-encoder/stsb-roberta-base'
+CROSS_ENCODER_NLI_MODEL_NAME = 'cross-encoder/nli-distilroberta-base'
+
+# Loading profiles of each scoring model, selected with MODEL_PROFILES or model_registry.set_profile():
+# "bf16" / "fp16" run the torch weights in half precision on CPU, "small" swaps in a distilled model
+SCORING_PROFILES = (DEFAULT_PROFILE, "bf16", "fp16", "small")
+HALF_PRECISION_PROFILES = ("bf16", "fp16")
+SMALL_MODEL_NAMES = {
+    "bi_encoder": "sentence-transformers/nli-distilroberta-base-v2",
+    "cross_encoder_stsb": "cross-encoder/stsb-distilroberta-base",
+    "cross_encoder_nli": "cross-encoder/nli-MiniLM2-L6-H768",
+}
+
+# Inference backend: "torch" (eager PyTorch fp32), "onnx" (ONNX Runtime fp32) or "onnx-int8"
+# (ONNX Runtime, dynamically quantized). Thread count 0 keeps the library default.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+SCORING_BACKEND = os.getenv("SCORING_BACKEND", "torch")
+SCORING_NUM_THREADS = int(os.getenv("SCORING_NUM_THREADS", "0"))
+
+# Largest marks difference (percentage points) an optimized backend may show against torch
+BACKEND_PARITY_TOLERANCE = 2.0
+
+
+def _set_torch_threads():
+    if SCORING_NUM_THREADS:
+        import torch
+        torch.set_num_threads(SCORING_NUM_THREADS)
+
+
+def _model_name(name, profile=None):
+    """Hugging Face model behind the scoring model `name` under `profile` (default: the selected one)."""
+    if (profile or model_profile(name)) == "small":
+        return SMALL_MODEL_NAMES[name]
+    return {
+        "bi_encoder": BI_ENCODER_MODEL_NAME,
+        "cross_encoder_stsb": CROSS_ENCODER_STSB_MODEL_NAME,
+        "cross_encoder_nli": CROSS_ENCODER_NLI_MODEL_NAME,
+    }[name]
+
+
+def _versioned_model_name(name):
+    """Model name plus any reduced precision, as recorded with scores and used to key cached embeddings."""
+    profile = model_profile(name)
+    return _model_name(name, profile) + (f"@{profile}" if profile in HALF_PRECISION_PROFILES else "")
+
+
+def _check_profile(profile):
+    if profile in HALF_PRECISION_PROFILES and SCORING_BACKEND != "torch":
+        raise ValueError(f"The '{profile}' profile needs the torch backend; use SCORING_BACKEND=onnx-int8 for a smaller ONNX model.")
+
+
+def _reduce_precision(model, profile):
+    """Cast a torch model's weights to bf16 / fp16 for the half-precision profiles."""
+    if profile not in HALF_PRECISION_PROFILES:
+        return model
+    import torch
+    dtype = torch.bfloat16 if profile == "bf16" else torch.float16
+    if hasattr(model, "predict"):
+        # CrossEncoder keeps the transformer in .model; hand float32 logits back so
+        # predict()'s activation and NumPy conversion behave as in full precision
+        model.model.to(dtype)
+        model.model.register_forward_hook(lambda module, inputs, output: output.__class__(**{**output, "logits": output.logits.float()}))
+    else:
+        model.to(dtype)
+    return model
+
+
+def _load_bi_encoder(profile=DEFAULT_PROFILE):
+    _check_profile(profile)
+    model_name = _model_name("bi_encoder", profile)
+    if SCORING_BACKEND != "torch":
+        from onnx_backend import load_bi_encoder
+        return load_bi_encoder(model_name, quantize=SCORING_BACKEND == "onnx-int8", num_threads=SCORING_NUM_THREADS)
+    from sentence_transformers import SentenceTransformer
+    _set_torch_threads()
+    return _reduce_precision(SentenceTransformer(model_name), profile)
+
+
+def _load_cross_encoder(name, profile):
+    _check_profile(profile)
+    model_name = _model_name(name, profile)
+    if SCORING_BACKEND != "torch":
+        from onnx_backend import OnnxCrossEncoder
+        return OnnxCrossEncoder(model_name, quantize=SCORING_BACKEND == "onnx-int8", num_threads=SCORING_NUM_THREADS)
+    from sentence_transformers import CrossEncoder
+    _set_torch_threads()
+    return _reduce_precision(CrossEncoder(model_name), profile)
+
+
+def _load_cross_encoder_stsb(profile=DEFAULT_PROFILE):
+    return _load_cross_encoder("cross_encoder_stsb", profile)
+
+
+def _load_cross_encoder_nli(profile=DEFAULT_PROFILE):
+    return _load_cross_encoder("cross_encoder_nli", profile)
+
+
+def _register_scoring_models():
+    register_model("bi_encoder", _load_bi_encoder, SCORING_PROFILES)
+    register_model("cross_encoder_stsb", _load_cross_encoder_stsb, SCORING_PROFILES)
+    register_model("cross_encoder_nli", _load_cross_encoder_nli, SCORING_PROFILES)
+
+
+# Models are loaded lazily on first use (or eagerly via warmup())
+_register_scoring_models()
+
+SCORING_MODELS = ("bi_encoder", "cross_encoder_stsb", "cross_encoder_nli")
+
+# Persist bi-encoder embeddings on disk; student answers can be left out of the store
+EMBEDDING_CACHE_ENABLED = True
+CACHE_STUDENT_EMBEDDINGS = True
+
+
+def set_backend(backend, num_threads=None):
+    """Switch the inference backend; models are reloaded on next use."""
+    global SCORING_BACKEND, SCORING_NUM_THREADS
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown scoring backend '{backend}'. Choose from {', '.join(BACKENDS)}.")
+    SCORING_BACKEND = backend
+    if num_threads is not None:
+        SCORING_NUM_THREADS = num_threads
+    _register_scoring_models()
+
+
+def _embedding_store_name():
+    # Optimized backends and profiles produce slightly different vectors, so they get their own store
+    model_name = _versioned_model_name("bi_encoder")
+    return model_name if SCORING_BACKEND == "torch" else f"{model_name}@{SCORING_BACKEND}"
+
+
+def warmup():
+    """Load all scoring models and run one tiny inference through each."""
+    for name in SCORING_MODELS:
+        get_model(name)
+    compute_similarity_and_marks("warm up", "warm up")
+
+
+def encode_texts(texts, batch_size=DEFAULT_BATCH_SIZE, cache=True):
+    """Normalized bi-encoder embeddings for `texts`, served from the embedding cache when possible."""
+    def encode(missing):
+        return get_model("bi_encoder").encode(missing, batch_size=batch_size, normalize_embeddings=True)
+
+    if not EMBEDDING_CACHE_ENABLED:
+        return encode(list(texts))
+    return get_store(_embedding_store_name()).encode(texts, encode, cache=cache)
+
+
+def cache_reference_embeddings(key_answers, batch_size=DEFAULT_BATCH_SIZE):
+    """Compute and persist embeddings for an exam's key answers once, up front."""
+    encode_texts(list(dict.fromkeys(key_answers)), batch_size=batch_size)
 
 # Dictionary of sentence pairs (Correct Answer, Student Answer)
 sentences_dict = {
@@ -86,10 +262,17 @@ sentences_dict = {
 
 
 # Define function for similarity scoring
+@span("score_pair")
 def compute_similarity_and_marks(correct_answer, student_answer):
+    if LONG_ANSWER_MODE:
+        return compute_similarity_and_marks_batch([(correct_answer, student_answer)])[0]
+
+    cross_encoder_stsb = get_model("cross_encoder_stsb")
+    cross_encoder_nli = get_model("cross_encoder_nli")
+
     # Bi-Encoder Similarity
-    vector1 = bi_encoder_model.encode(correct_answer, normalize_embeddings=True)
-    vector2 = bi_encoder_model.encode(student_answer, normalize_embeddings=True)
+    vector1 = encode_texts([correct_answer])[0]
+    vector2 = encode_texts([student_answer], cache=CACHE_STUDENT_EMBEDDINGS)[0]
     bi_encoder_score = 1 - cosine(vector1, vector2)
 
     # Cross-Encoder Similarity
@@ -101,13 +284,13 @@ def compute_similarity_and_marks(correct_answer, student_answer):
     adjusted_opposite_score = 1 - contradiction_score  # Higher means more similar
 
     # **Updated Weights**
-    average_score = (0.3 * bi_encoder_score) + (0.5 * cross_encoder_score) + (0.2 * adjusted_opposite_score)
+    average_score = (BI_ENCODER_WEIGHT * bi_encoder_score) + (CROSS_ENCODER_WEIGHT * cross_encoder_score) + (NLI_WEIGHT * adjusted_opposite_score)
 
     # **New Marks Formula**
     def similarity_to_marks(similarity_score):
-        if similarity_score < 0.6:
+        if similarity_score < MARKS_THRESHOLD:
             return 0  # Below 0.6, no marks
-        return ((similarity_score - 0.6) / 0.4) * 90 + 10  # Scale from 10% to 100%
+        return ((similarity_score - MARKS_THRESHOLD) / (1 - MARKS_THRESHOLD)) * 90 + 10  # Scale from 10% to 100%
 
     marks_percentage = similarity_to_marks(average_score)
 
@@ -115,8 +298,8 @@ def compute_similarity_and_marks(correct_answer, student_answer):
     expected_length = len(correct_answer.split())
     student_length = len(student_answer.split())
 
-    if student_length < 0.8 * expected_length:
-        marks_percentage *= 0.85  # Apply 15% penalty
+    if student_length < LENGTH_PENALTY_RATIO * expected_length:
+        marks_percentage *= LENGTH_PENALTY_FACTOR  # Apply 15% penalty
 
     return {
         "Bi-Encoder Score": bi_encoder_score,
@@ -126,17 +309,384 @@ def compute_similarity_and_marks(correct_answer, student_answer):
         "Marks Percentage": marks_percentage
     }
 
-# Process all sentence pairs
-results = {}
 
-for key, (correct, student) in sentences_dict.items():
-    results[key] = compute_similarity_and_marks(correct, student)
+def _cosine_similarity_rows(a, b):
+    """Row-wise 1 - scipy cosine distance, kept in the embeddings' dtype like scipy does."""
+    uv = np.einsum("ij,ij->i", a, b)
+    uu = np.einsum("ij,ij->i", a, a)
+    vv = np.einsum("ij,ij->i", b, b)
+    distance = np.clip(1 - uv / np.sqrt(uu * vv), 0, 2)
+    return 1 - distance
+
+
+def _similarity_to_marks_batch(similarity_scores, threshold=None):
+    """Vectorized version of the marks curve used by compute_similarity_and_marks."""
+    threshold = MARKS_THRESHOLD if threshold is None else threshold
+    marks = ((similarity_scores - threshold) / (1 - threshold)) * 90 + 10
+    return np.where(similarity_scores < threshold, 0, marks)
+
+
+def _short_answer_mask(pairs):
+    """Which student answers are short enough to get the length penalty."""
+    expected_lengths = np.array([len(correct.split()) for correct, _ in pairs])
+    student_lengths = np.array([len(student.split()) for _, student in pairs])
+    return student_lengths < LENGTH_PENALTY_RATIO * expected_lengths
+
+
+def _long_answer_window():
+    """Tokens per window: what the bi-encoder reads whole, and two of which fit one cross-encoder input."""
+    if LONG_ANSWER_WINDOW_TOKENS:
+        return LONG_ANSWER_WINDOW_TOKENS
+    bi_encoder, cross_encoder = get_model("bi_encoder"), get_model("cross_encoder_stsb")
+    bi_encoder_limit = getattr(bi_encoder, "max_seq_length", None) or bi_encoder.tokenizer.model_max_length
+    cross_encoder_limit = getattr(cross_encoder, "max_length", None) or cross_encoder.tokenizer.model_max_length
+    return min(bi_encoder_limit - 2, (cross_encoder_limit - 4) // 2)  # Room for special tokens
+
+
+def _token_windows(text, tokenizer, window, overlap):
+    """Split `text` at word boundaries into windows of at most `window` tokens.
+
+    Consecutive windows share up to `overlap` tokens. Returns [(window_text, tokens)].
+    """
+    words = text.split()
+    if not words:
+        return [(text, 0)]
+    # Leading space so BPE tokenizers count a word as they would mid-sentence
+    lengths = [min(len(ids), window) for ids in tokenizer([" " + word for word in words], add_special_tokens=False)["input_ids"]]
+
+    windows, start = [], 0
+    while True:
+        end, tokens = start, 0
+        while end < len(words) and (end == start or tokens + lengths[end] <= window):
+            tokens += lengths[end]
+            end += 1
+        windows.append((" ".join(words[start:end]), tokens))
+        if end == len(words):
+            return windows
+        # Step back over the last few words so the next window overlaps this one
+        next_start, carried = end, 0
+        while next_start - 1 > start and carried + lengths[next_start - 1] <= overlap:
+            next_start -= 1
+            carried += lengths[next_start]
+        start = next_start
+
+
+@span("long_answer_windows")
+def _align_long_answers(pairs, batch_size):
+    """Window alignments for pairs longer than one model window, None for the others.
+
+    Each alignment holds the pair's bi-encoder score (cosine of the
+    token-weighted mean window embeddings), the (key window, student window)
+    candidates for the cross-encoders, LONG_ANSWER_CANDIDATES per key window
+    or fewer, and the token count of each key window.
+    """
+    tokenizer = get_model("bi_encoder").tokenizer
+    window = _long_answer_window()
+    overlap = int(window * LONG_ANSWER_OVERLAP)
+    windows = {text: _token_windows(text, tokenizer, window, overlap) for pair in pairs for text in pair}
+    # A blank student answer has nothing to align, so it takes the short path like any other pair
+    long_pairs = [i for i, (correct, student) in enumerate(pairs)
+                  if student.split() and (len(windows[correct]) > 1 or len(windows[student]) > 1)]
+    alignments = [None] * len(pairs)
+    if not long_pairs:
+        return alignments
+
+    key_texts = list(dict.fromkeys(text for i in long_pairs for text, _ in windows[pairs[i][0]]))
+    student_texts = list(dict.fromkeys(text for i in long_pairs for text, _ in windows[pairs[i][1]]))
+    embeddings = dict(zip(student_texts, encode_texts(student_texts, batch_size=batch_size, cache=CACHE_STUDENT_EMBEDDINGS)))
+    embeddings.update(zip(key_texts, encode_texts(key_texts, batch_size=batch_size)))
+
+    for i in long_pairs:
+        key_windows, student_windows = windows[pairs[i][0]], windows[pairs[i][1]]
+        key_vectors = np.stack([embeddings[text] for text, _ in key_windows])
+        student_vectors = np.stack([embeddings[text] for text, _ in student_windows])
+        # At least one token per window, so pooled vectors and averaged scores are never 0/0
+        key_weights = np.array([max(tokens, 1) for _, tokens in key_windows], dtype=key_vectors.dtype)
+        student_weights = np.array([max(tokens, 1) for _, tokens in student_windows], dtype=student_vectors.dtype)
+
+        # Normalized embeddings, so the dot product is the cosine of every window pair
+        candidates = np.argsort(-(key_vectors @ student_vectors.T), axis=1, kind="stable")[:, :LONG_ANSWER_CANDIDATES]
+        alignments[i] = {
+            "bi_encoder": _cosine_similarity_rows((key_weights @ key_vectors)[None], (student_weights @ student_vectors)[None])[0],
+            "candidates": [(key_windows[k][0], student_windows[j][0]) for k in range(len(key_windows)) for j in candidates[k]],
+            "candidates_per_window": candidates.shape[1],
+            "key_weights": key_weights,
+        }
+        _long_answer_counts["window_pairs"] += candidates.size
+        _long_answer_counts["all_window_pairs"] += len(key_windows) * len(student_windows)
+    _long_answer_counts["pairs"] += len(long_pairs)
+    return alignments
+
+
+@span("bi_encoder")
+def _bi_encoder_scores(pairs, batch_size, alignments=None):
+    """Stage 1: bi-encoder cosine for every pair, encoding each distinct text once.
+
+    Pairs with an alignment (see _align_long_answers) take its window-pooled score.
+    """
+    if alignments:
+        short = [i for i, alignment in enumerate(alignments) if alignment is None]
+        scores = np.array([np.nan if alignment is None else alignment["bi_encoder"] for alignment in alignments], dtype=np.float32)
+        if short:
+            scores[short] = _bi_encoder_scores([pairs[i] for i in short], batch_size)
+        return scores
+
+    # Key answers repeat across students, so deduplicate before encoding
+    unique_correct = list(dict.fromkeys(correct for correct, _ in pairs))
+    unique_student = list(dict.fromkeys(student for _, student in pairs))
+    correct_embeddings = dict(zip(unique_correct, encode_texts(unique_correct, batch_size=batch_size)))
+    student_embeddings = dict(zip(unique_student, encode_texts(unique_student, batch_size=batch_size, cache=CACHE_STUDENT_EMBEDDINGS)))
+    correct_vectors = np.stack([correct_embeddings[correct] for correct, _ in pairs])
+    student_vectors = np.stack([student_embeddings[student] for _, student in pairs])
+    return _cosine_similarity_rows(correct_vectors, student_vectors)
+
+
+def _cross_encoder_scores(pairs, batch_size, alignments=None):
+    """Stage 2: STS-B similarity and 1 - NLI contradiction for every pair.
+
+    Pairs with an alignment are scored on their candidate window pairs, in the
+    same batches as the others. Each key window keeps the student window the
+    STS-B model rates highest, and key windows are averaged by token count.
+    """
+    alignments = alignments or [None] * len(pairs)
+    pair_lists, offsets = [], []
+    for pair, alignment in zip(pairs, alignments):
+        offsets.append(len(pair_lists))
+        pair_lists.extend([correct, student] for correct, student in ([pair] if alignment is None else alignment["candidates"]))
+
+    # Cross-Encoder Similarity
+    with span("cross_encoder_stsb"):
+        cross_encoder_scores = np.asarray(get_model("cross_encoder_stsb").predict(pair_lists, batch_size=batch_size))
+
+    # NLI Contradiction Score
+    with span("cross_encoder_nli"):
+        nli_scores = np.asarray(get_model("cross_encoder_nli").predict(pair_lists, apply_softmax=True, batch_size=batch_size))
+    adjusted_opposite_scores = 1 - nli_scores[:, 0]
+    if not any(alignments):
+        return cross_encoder_scores, adjusted_opposite_scores
+
+    pair_cross_scores = cross_encoder_scores[offsets]
+    pair_adjusted_scores = adjusted_opposite_scores[offsets]
+    for i, (offset, alignment) in enumerate(zip(offsets, alignments)):
+        if alignment is None:
+            continue
+        window_slice = slice(offset, offset + len(alignment["candidates"]))
+        window_cross = cross_encoder_scores[window_slice].reshape(-1, alignment["candidates_per_window"])
+        window_adjusted = adjusted_opposite_scores[window_slice].reshape(window_cross.shape)
+        best = (np.arange(len(window_cross)), window_cross.argmax(axis=1))
+        pair_cross_scores[i] = np.average(window_cross[best], weights=alignment["key_weights"])
+        pair_adjusted_scores[i] = np.average(window_adjusted[best], weights=alignment["key_weights"])
+    return pair_cross_scores, pair_adjusted_scores
+
+
+def _marks_from_scores(pairs, average_scores):
+    """Marks curve and length penalty applied to a vector of weighted scores."""
+    marks_percentages = _similarity_to_marks_batch(average_scores)
+    return np.where(_short_answer_mask(pairs), marks_percentages * LENGTH_PENALTY_FACTOR, marks_percentages)
+
+
+def scoring_params():
+    """The weights and marks-curve constants currently in effect, as recorded with each graded item."""
+    return {
+        "bi_encoder_weight": BI_ENCODER_WEIGHT,
+        "cross_encoder_weight": CROSS_ENCODER_WEIGHT,
+        "nli_weight": NLI_WEIGHT,
+        "marks_threshold": MARKS_THRESHOLD,
+        "length_penalty_ratio": LENGTH_PENALTY_RATIO,
+        "length_penalty_factor": LENGTH_PENALTY_FACTOR,
+    }
+
+
+def set_scoring_params(params):
+    """Put weights and marks-curve constants (a scoring_params() dict, possibly partial) into effect."""
+    global BI_ENCODER_WEIGHT, CROSS_ENCODER_WEIGHT, NLI_WEIGHT, MARKS_THRESHOLD, LENGTH_PENALTY_RATIO, LENGTH_PENALTY_FACTOR
+    unknown = set(params) - set(scoring_params())
+    if unknown:
+        raise ValueError(f"Unknown scoring parameters: {', '.join(sorted(unknown))}.")
+    BI_ENCODER_WEIGHT = params.get("bi_encoder_weight", BI_ENCODER_WEIGHT)
+    CROSS_ENCODER_WEIGHT = params.get("cross_encoder_weight", CROSS_ENCODER_WEIGHT)
+    NLI_WEIGHT = params.get("nli_weight", NLI_WEIGHT)
+    MARKS_THRESHOLD = params.get("marks_threshold", MARKS_THRESHOLD)
+    LENGTH_PENALTY_RATIO = params.get("length_penalty_ratio", LENGTH_PENALTY_RATIO)
+    LENGTH_PENALTY_FACTOR = params.get("length_penalty_factor", LENGTH_PENALTY_FACTOR)
+
+
+def model_versions():
+    """Which models (profile and backend included) produced the raw scores; a change here means the scores must be recomputed."""
+    versions = {name: _versioned_model_name(name) for name in SCORING_MODELS}
+    versions["backend"] = SCORING_BACKEND
+    if LONG_ANSWER_MODE:
+        versions["long_answers"] = f"window={LONG_ANSWER_WINDOW_TOKENS or 'auto'},overlap={LONG_ANSWER_OVERLAP},candidates={LONG_ANSWER_CANDIDATES}"
+    return versions
+
+
+def marks_from_raw_scores(bi_encoder_scores, cross_encoder_scores, adjusted_opposite_scores,
+                          expected_lengths, student_lengths, params=None):
+    """Weighted scores and marks from stored stage scores, without running any model.
+
+    All arguments are equal-length arrays; lengths are word counts of the key
+    and student answers. NaN cross-encoder scores mark pairs settled by the
+    cascade's first stage, whose weighted score is the bi-encoder score.
+    `params` defaults to scoring_params(). Returns (average_scores, marks).
+    """
+    params = params or scoring_params()
+    bi_encoder_scores = np.asarray(bi_encoder_scores)
+    cross_encoder_scores = np.asarray(cross_encoder_scores)
+    adjusted_opposite_scores = np.asarray(adjusted_opposite_scores)
+
+    average_scores = (params["bi_encoder_weight"] * bi_encoder_scores) + (params["cross_encoder_weight"] * cross_encoder_scores) + (params["nli_weight"] * adjusted_opposite_scores)
+    average_scores = np.where(np.isnan(cross_encoder_scores), bi_encoder_scores, average_scores)
+
+    marks_percentages = _similarity_to_marks_batch(average_scores, params["marks_threshold"])
+    short_answers = np.asarray(student_lengths) < params["length_penalty_ratio"] * np.asarray(expected_lengths)
+    return average_scores, np.where(short_answers, marks_percentages * params["length_penalty_factor"], marks_percentages)
+
+
+def compute_similarity_and_marks_batch(pairs, batch_size=DEFAULT_BATCH_SIZE, cascade=False):
+    """Score many (correct_answer, student_answer) pairs with one batched pass per model.
+
+    Returns a list of dicts in the same order and with the same keys as
+    compute_similarity_and_marks would return for each pair. With
+    cascade=True, see compute_similarity_and_marks_cascade.
+    """
+    if cascade:
+        return compute_similarity_and_marks_cascade(pairs, batch_size=batch_size)
+
+    pairs = [(correct, student) for correct, student in pairs]
+    if not pairs:
+        return []
+
+    alignments = _align_long_answers(pairs, batch_size) if LONG_ANSWER_MODE else None
+    bi_encoder_scores = _bi_encoder_scores(pairs, batch_size, alignments)
+    cross_encoder_scores, adjusted_opposite_scores = _cross_encoder_scores(pairs, batch_size, alignments)
+
+    average_scores = (BI_ENCODER_WEIGHT * bi_encoder_scores) + (CROSS_ENCODER_WEIGHT * cross_encoder_scores) + (NLI_WEIGHT * adjusted_opposite_scores)
+    marks_percentages = _marks_from_scores(pairs, average_scores)
+
+    return [
+        {
+            "Bi-Encoder Score": bi_encoder_scores[i],
+            "Cross-Encoder Score": cross_encoder_scores[i],
+            "Adjusted Opposite Score": adjusted_opposite_scores[i],
+            "Weighted Average Score": average_scores[i],
+            "Marks Percentage": marks_percentages[i]
+        }
+        for i in range(len(pairs))
+    ]
+
+
+def cascade_stats():
+    """How many pairs each cascade stage has settled since the last reset."""
+    stats = dict(_cascade_counts)
+    total = stats["pairs"] or 1
+    stats["bi_encoder_rate"] = stats["bi_encoder"] / total
+    stats["cross_encoders_rate"] = stats["cross_encoders"] / total
+    return stats
+
+
+def reset_cascade_stats():
+    for stage in _cascade_counts:
+        _cascade_counts[stage] = 0
+
+
+def long_answer_stats():
+    """How many long pairs were windowed, and window pairs scored versus an exhaustive all-pairs comparison."""
+    stats = dict(_long_answer_counts)
+    stats["window_pair_rate"] = stats["window_pairs"] / (stats["all_window_pairs"] or 1)
+    return stats
+
+
+def reset_long_answer_stats():
+    for key in _long_answer_counts:
+        _long_answer_counts[key] = 0
+
+
+def compute_similarity_and_marks_cascade(pairs, batch_size=DEFAULT_BATCH_SIZE,
+                                         low_band=CASCADE_LOW_BAND, high_band=CASCADE_HIGH_BAND):
+    """Bi-encoder first; run the cross-encoders only on pairs it cannot settle.
+
+    A pair whose bi-encoder score is <= low_band (clearly off-topic) or
+    >= high_band (near-verbatim) is settled by stage 1: its weighted score is
+    the bi-encoder score, and the skipped cross-encoder scores are None.
+    Every dict carries a "Cascade Stage" key ("bi_encoder" or "cross_encoders").
+    """
+    pairs = [(correct, student) for correct, student in pairs]
+    if not pairs:
+        return []
+
+    alignments = _align_long_answers(pairs, batch_size) if LONG_ANSWER_MODE else None
+    bi_encoder_scores = _bi_encoder_scores(pairs, batch_size, alignments)
+    uncertain = np.flatnonzero((bi_encoder_scores > low_band) & (bi_encoder_scores < high_band))
+
+    average_scores = bi_encoder_scores.copy()
+    cross_encoder_scores = [None] * len(pairs)
+    adjusted_opposite_scores = [None] * len(pairs)
+    if len(uncertain):
+        uncertain_alignments = [alignments[i] for i in uncertain] if alignments else None
+        cross, adjusted = _cross_encoder_scores([pairs[i] for i in uncertain], batch_size, uncertain_alignments)
+        average_scores[uncertain] = (BI_ENCODER_WEIGHT * bi_encoder_scores[uncertain]) + (CROSS_ENCODER_WEIGHT * cross) + (NLI_WEIGHT * adjusted)
+        for k, i in enumerate(uncertain):
+            cross_encoder_scores[i] = cross[k]
+            adjusted_opposite_scores[i] = adjusted[k]
+    marks_percentages = _marks_from_scores(pairs, average_scores)
+
+    _cascade_counts["pairs"] += len(pairs)
+    _cascade_counts["bi_encoder"] += len(pairs) - len(uncertain)
+    _cascade_counts["cross_encoders"] += len(uncertain)
+
+    return [
+        {
+            "Bi-Encoder Score": bi_encoder_scores[i],
+            "Cross-Encoder Score": cross_encoder_scores[i],
+            "Adjusted Opposite Score": adjusted_opposite_scores[i],
+            "Weighted Average Score": average_scores[i],
+            "Marks Percentage": marks_percentages[i],
+            "Cascade Stage": "bi_encoder" if cross_encoder_scores[i] is None else "cross_encoders"
+        }
+        for i in range(len(pairs))
+    ]
+
+
+def check_backend_parity(backend, pairs=None, tolerance=BACKEND_PARITY_TOLERANCE, batch_size=DEFAULT_BATCH_SIZE):
+    """Compare marks from `backend` against the torch backend on `pairs` (default: sentences_dict).
+
+    Returns {"backend", "max_drift", "mean_drift", "tolerance", "passed"}; the
+    active backend is restored afterwards.
+    """
+    global EMBEDDING_CACHE_ENABLED
+    pairs = list(pairs if pairs is not None else sentences_dict.values())
+    previous_backend, previous_cache = SCORING_BACKEND, EMBEDDING_CACHE_ENABLED
+    EMBEDDING_CACHE_ENABLED = False  # Compare fresh model outputs, not stored vectors
+    try:
+        set_backend("torch")
+        reference = compute_similarity_and_marks_batch(pairs, batch_size=batch_size)
+        set_backend(backend)
+        candidate = compute_similarity_and_marks_batch(pairs, batch_size=batch_size)
+    finally:
+        EMBEDDING_CACHE_ENABLED = previous_cache
+        set_backend(previous_backend)
+
+    drifts = [abs(float(ref["Marks Percentage"]) - float(cand["Marks Percentage"])) for ref, cand in zip(reference, candidate)]
+    max_drift = max(drifts, default=0.0)
+    return {
+        "backend": backend,
+        "max_drift": max_drift,
+        "mean_drift": sum(drifts) / len(drifts) if drifts else 0.0,
+        "tolerance": tolerance,
+        "passed": max_drift <= tolerance,
+    }
+
+
+if __name__ == "__main__":
+    # Process all sentence pairs
+    batch_results = compute_similarity_and_marks_batch(sentences_dict.values())
+    results = dict(zip(sentences_dict.keys(), batch_results))
 
-# Print results for each question
-for topic, scores in results.items():
-    print(f"\n=== {topic.upper()} ===")
-    # print(f"Bi-Encoder Score: {scores['Bi-Encoder Score']:.4f}")
-    # print(f"Cross-Encoder STSB Score: {scores['Cross-Encoder Score']:.4f}")
-    # print(f"Adjusted Opposite Score: {scores['Adjusted Opposite Score']:.4f}")
-    # print(f"Weighted Average Score: {scores['Weighted Average Score']:.4f}")
-    print(f"Marks Percentage: {scores['Marks Percentage']:.2f}%")
+    # Print results for each question
+    for topic, scores in results.items():
+        print(f"\n=== {topic.upper()} ===")
+        # print(f"Bi-Encoder Score: {scores['Bi-Encoder Score']:.4f}")
+        # print(f"Cross-Encoder STSB Score: {scores['Cross-Encoder Score']:.4f}")
+        # print(f"Adjusted Opposite Score: {scores['Adjusted Opposite Score']:.4f}")
+        # print(f"Weighted Average Score: {scores['Weighted Average Score']:.4f}")
+        print(f"Marks Percentage: {scores['Marks Percentage']:.2f}%")
@@ -1,14 +1,48 @@
 import spacy
+from instrumentation import TOKENS, span
+from model_registry import register_model, get_model
+
+SPACY_MODEL_NAME = "en_core_web_sm"
+# Only lemmas, stop-word flags and punctuation flags are used, so skip parsing and NER
+EXCLUDED_COMPONENTS = ["parser", "ner"]
+
+# nlp.pipe defaults for batched preprocessing
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_N_PROCESS = 1
+
+
+def _load_nlp():
+    return spacy.load(SPACY_MODEL_NAME, exclude=EXCLUDED_COMPONENTS)
+
+
+# Load SpaCy model lazily on first use
+register_model("spacy", _load_nlp)
+
+
+def _lemmatize(doc):
+    """Lemmas of the non-stopword, non-punctuation tokens of a parsed answer."""
+    return " ".join(token.lemma_ for token in doc if not token.is_stop and not token.is_punct)
+
+
+def preprocess_answer_sheets(sheets, batch_size=DEFAULT_BATCH_SIZE, n_process=DEFAULT_N_PROCESS):
+    """Tokenize, remove stopwords, and lemmatize the answers of many sheets in one nlp.pipe run.
+
+    `sheets` is an iterable of {question number: answer} dicts; returns a list
+    of processed dicts in the same order.
+    """
+    sheets = list(sheets)
+    keys = [(i, q_num) for i, answers_dict in enumerate(sheets) for q_num in answers_dict]
+    texts = (sheets[i][q_num] for i, q_num in keys)
+
+    processed_sheets = [{} for _ in sheets]
+    with span("preprocess"):
+        docs = get_model("spacy").pipe(texts, batch_size=batch_size, n_process=n_process)
+        for (i, q_num), doc in zip(keys, docs):
+            TOKENS.observe(len(doc), kind="answer")
+            processed_sheets[i][q_num] = _lemmatize(doc)
+    return processed_sheets
 
-# Load SpaCy model
-nlp = spacy.load("en_core_web_sm")
 
 def preprocess_answers(answers_dict):
     """Tokenize, remove stopwords, and lemmatize answers."""
-    processed_answers = {}
-    for q_num, answer in answers_dict.items():
-        doc = nlp(answer)
-        processed_tokens = [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
-        processed_answers[q_num] = " ".join(processed_tokens)
-    
-    return processed_answers  # Return processed answers dictionary
+    return preprocess_answer_sheets([answers_dict])[0]  # Return processed answers dictionary